@@ -0,0 +1,186 @@
+"""
+Micro-benchmarks for the normalization and scoring hot paths of import_music.py.
+
+Runs normalize_title, base_title, primary_artist, build_queries, track_features,
+score_candidate and score_pairs over a generated corpus of realistic titles and
+artists (accents and other non-ASCII names, "feat." / "ft." / "featuring"
+variants, bracketed remasters and versions, multi-artist strings) and reports,
+per function, ns/op (best of --repeat passes) and the memory it allocates per op
+as measured by tracemalloc:
+
+    python bench_hotpaths.py --out hotpaths.json
+    python bench_hotpaths.py --compare hotpaths.json --max-regression 0.15
+
+With --compare the run exits with status 1 when any function got slower than
+the saved result by more than --max-regression.
+"""
+import argparse
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import import_music as im
+
+WORDS = ("love", "night", "heart", "fire", "summer", "dream", "light", "river", "city", "gold",
+         "shadow", "rain", "road", "dance", "stars", "ocean", "wild", "home", "ghost", "electric",
+         "corazón", "noche", "über", "mañana", "café", "été", "señorita", "naïve", "déjà vu", "fiancé")
+ARTISTS = ("The Weeknd", "Beyoncé", "Sigur Rós", "Motörhead", "Björk", "Daft Punk", "Rosalía",
+           "Mötley Crüe", "Röyksopp", "Céline Dion", "Arctic Monkeys", "Florence + The Machine",
+           "Hozier", "Lorde", "Kendrick Lamar", "Fleetwood Mac", "Tame Impala", "Sade", "AC/DC",
+           "坂本龍一", "BTS", "Маша и Медведи", "Ólafur Arnalds", "Zoë Keating", "Jóhann Jóhannsson")
+FEATS = ("feat.", "Feat.", "ft.", "featuring", "feat")
+VERSIONS = ("Remastered", "2011 Remaster", "Remastered 2009", "Live", "Radio Edit", "Acoustic",
+            "Deluxe Edition", "Single Version", "Mono", "Extended Mix")
+
+def _title(rng: random.Random) -> str:
+    title = " ".join(rng.sample(WORDS, rng.randint(1, 5))).title()
+    roll = rng.random()
+    if roll < 0.2:
+        open_, close = rng.choice((("(", ")"), ("[", "]")))
+        title += f" {open_}{rng.choice(FEATS)} {_artist(rng)}{close}"
+    elif roll < 0.25:
+        title += f" {rng.choice(FEATS)} {rng.choice(ARTISTS)}"
+    if rng.random() < 0.25:
+        version = rng.choice(VERSIONS)
+        title += rng.choice((f" ({version})", f" [{version}]", f" - {version}"))
+    return title
+
+def _artist(rng: random.Random) -> str:
+    names = rng.sample(ARTISTS, rng.choice((1, 1, 1, 2, 2, 3)))
+    out = names[0]
+    for name in names[1:]:
+        out += rng.choice((", ", " & ", " / ", " x ", " and ")) + name
+    return out
+
+def _candidate(rng: random.Random, track: dict) -> dict:
+    """A search result as YT Music would return it for `track`, or for something else."""
+    if rng.random() < 0.5:
+        title = im.base_title(track["Name"]) + rng.choice(("", "", " (Official Video)", " (Live)", " - Remastered"))
+        artists = track["Artist"].replace(" & ", ", ").split(", ")
+    else:
+        title, artists = _title(rng), _artist(rng).split(", ")
+    return {"videoId": f"v{rng.getrandbits(40):010x}", "title": title,
+            "artists": [{"name": a} for a in artists], "resultType": "song",
+            "duration_seconds": rng.randint(120, 420)}
+
+def make_corpus(size: int, seed: int) -> Tuple[List[dict], List[dict]]:
+    """`size` source tracks and one search result to score against each."""
+    rng = random.Random(seed)
+    tracks = [{"Name": _title(rng), "Artist": _artist(rng), "Total Time": rng.randint(120, 420) * 1000}
+              for _ in range(size)]
+    return tracks, [_candidate(rng, t) for t in tracks]
+
+def _clear_caches():
+    im._candidate_title_norm.cache_clear()
+    im._candidate_artist_norm.cache_clear()
+
+def cases(tracks: List[dict], candidates: List[dict]) -> Dict[str, Tuple[Callable[[], object], int]]:
+    """name -> (one pass over the corpus, ops in that pass)."""
+    titles = [t["Name"] for t in tracks]
+    artists = [t["Artist"] for t in tracks]
+    features = [im.track_features(t) for t in tracks]
+    pairs = list(zip(tracks, candidates))
+    n = len(tracks)
+    return {
+        "normalize_title": (lambda: [im.normalize_title(t) for t in titles], n),
+        "base_title": (lambda: [im.base_title(t) for t in titles], n),
+        "primary_artist": (lambda: [im.primary_artist(a) for a in artists], n),
+        "build_queries": (lambda: [im.build_queries(t) for t in tracks], n),
+        "track_features": (lambda: [im.track_features(t) for t in tracks], n),
+        "score_candidate": (lambda: [im.score_candidate(t, c) for t, c in pairs], n),
+        "score_pairs": (lambda: im.score_pairs(features, candidates), n),
+    }
+
+def time_case(fn: Callable[[], object], ops: int, repeat: int) -> float:
+    """Best ns/op over `repeat` passes, each with cold candidate-normalization caches."""
+    best = float("inf")
+    for _ in range(repeat):
+        _clear_caches()
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter_ns()
+            fn()
+            best = min(best, time.perf_counter_ns() - start)
+        finally:
+            gc.enable()
+    return best / ops
+
+def alloc_case(fn: Callable[[], object], ops: int) -> Tuple[float, float]:
+    """
+    (peak bytes, retained bytes) per op of one traced pass. Peak covers the results
+    of the pass plus its temporaries; retained is what outlives it (cache entries).
+    """
+    _clear_caches()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        result = fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        del result
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return (peak - base) / ops, (retained - base) / ops
+
+def run(args) -> dict:
+    tracks, candidates = make_corpus(args.size, args.seed)
+    results = {}
+    for name, (fn, ops) in cases(tracks, candidates).items():
+        if args.only and name not in args.only:
+            continue
+        fn()  # warm-up: regex compilation, rapidfuzz / numpy imports
+        ns = time_case(fn, ops, args.repeat)
+        peak, retained = alloc_case(fn, ops)
+        results[name] = {"ns_per_op": round(ns, 1), "alloc_bytes_per_op": round(peak, 1),
+                         "retained_bytes_per_op": round(retained, 1)}
+    return {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "python": sys.version.split()[0],
+            "corpus": {"size": args.size, "seed": args.seed}, "repeat": args.repeat, "results": results}
+
+def compare(current: dict, baseline: dict, max_regression: float) -> List[str]:
+    """Functions more than `max_regression` slower than in `baseline`, as messages."""
+    slower = []
+    for name, now in current["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if not before or not before.get("ns_per_op"):
+            continue
+        change = now["ns_per_op"] / before["ns_per_op"] - 1
+        if change > max_regression:
+            slower.append(f"{name}: {before['ns_per_op']:.0f} -> {now['ns_per_op']:.0f} ns/op (+{change:.0%})")
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=5000, help="tracks in the generated corpus")
+    parser.add_argument("--repeat", type=int, default=15, help="timed passes per function (best is kept)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", nargs="+", help="benchmark only these functions")
+    parser.add_argument("--out", type=Path, help="write the result as JSON to this file")
+    parser.add_argument("--compare", type=Path, help="a saved result to check for regressions against")
+    parser.add_argument("--max-regression", type=float, default=0.15,
+                        help="allowed slowdown against --compare, as a fraction")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(f"{'function':<18} {'ns/op':>10} {'alloc B/op':>11} {'kept B/op':>10}")
+    for name, r in result["results"].items():
+        print(f"{name:<18} {r['ns_per_op']:10.0f} {r['alloc_bytes_per_op']:11.0f} {r['retained_bytes_per_op']:10.0f}")
+    if args.out:
+        args.out.write_text(json.dumps(result, indent=2), encoding="utf-8")
+        print(f"\nSaved: {args.out}")
+    if args.compare:
+        slower = compare(result, json.loads(args.compare.read_text(encoding="utf-8")), args.max_regression)
+        if slower:
+            print("\nRegressions:\n  " + "\n  ".join(slower))
+            raise SystemExit(1)
+        print(f"\nNo function more than {args.max_regression:.0%} slower than {args.compare}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""
+End-to-end throughput benchmark of import_music.main() against ReplayClient.
+
+Generates a synthetic library (N playlists x M tracks, with a configurable share
+of each playlist drawn from tracks other playlists also contain) and the search /
+album fixtures that answer it, then runs the whole pipeline in a scratch
+directory with fresh state, so every track is matched from scratch. The pipeline
+runs in a child process of its own and the replay client in another, so the peak
+RSS reported is the pipeline's alone, not the generator's or the fixtures':
+
+    python bench_pipeline.py --playlists 20 --tracks 200 --overlap 0.3 --latency 0.08 --out bench.jsonl
+
+Prints one JSON object: tracks/sec, API calls per track (and per unique track),
+p50/p95/p99 per-track latency (from a worker picking a track up to its match
+being known), the same percentiles of the time tracks waited in the match queue
+before that, and the pipeline process's peak RSS. With --out the same object is
+appended as one line to that file, to track over time.
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import multiprocessing
+import os
+import plistlib
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from multiprocessing.managers import BaseManager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from replay_client import ReplayClient, fixture_key
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+WORDS = ("love", "night", "heart", "fire", "summer", "dream", "light", "river", "city", "gold",
+         "shadow", "rain", "road", "dance", "stars", "ocean", "wild", "home", "ghost", "electric",
+         "midnight", "blue", "young", "forever", "silence", "storm", "paradise", "echo", "runaway", "glass")
+ARTISTS = ("The Weeknd", "Beyoncé", "Sigur Rós", "Motörhead", "Björk", "Daft Punk", "Rosalía",
+           "Mötley Crüe", "Röyksopp", "Céline Dion", "Arctic Monkeys", "Florence + The Machine",
+           "Simon & Garfunkel", "Earth, Wind & Fire", "Crosby, Stills, Nash & Young", "AC/DC",
+           "Hozier", "Lorde", "Kendrick Lamar", "Fleetwood Mac", "Tame Impala", "Sade", "Los Lobos")
+DECORATIONS = ("", "", "", "", " (feat. {guest})", " [feat. {guest}]", " (Remastered 2011)",
+               " - 2009 Remaster", " (Live)", " (Radio Edit)")
+
+def _title(rng: random.Random) -> str:
+    words = rng.sample(WORDS, rng.randint(1, 4))
+    title = " ".join(words).title()
+    return title + rng.choice(DECORATIONS).format(guest=rng.choice(ARTISTS))
+
+def _artist(rng: random.Random) -> str:
+    artist = rng.choice(ARTISTS)
+    if rng.random() < 0.15:
+        artist += rng.choice((" & ", ", ", " / ")) + rng.choice(ARTISTS)
+    return artist
+
+def _result(vid: str, title: str, artist: str, seconds: int, kind: str = "song") -> dict:
+    return {"videoId": vid, "title": title, "artists": [{"name": a.strip()} for a in artist.split(",")],
+            "duration_seconds": seconds, "resultType": kind}
+
+def make_library(playlists: int, tracks: int, overlap: float, miss_rate: float, hard_rate: float,
+                 seed: int, build_queries: Callable[[dict], List[str]]) -> Tuple[dict, dict]:
+    """
+    Returns (plist, fixtures). Tracks come in albums of 8-14, so album batching
+    has groups to work with. `overlap` of each playlist is drawn from a pool shared
+    by all playlists, the rest is new to it. `miss_rate` of the tracks have no
+    search results at all; `hard_rate` only turn up for the second query variant.
+    """
+    rng = random.Random(seed)
+    library: Dict[int, dict] = {}
+    fixtures = {"search": {}, "albums": {}, "library_playlists": [], "playlists": {}}
+
+    def album() -> List[dict]:
+        album_artist = _artist(rng)
+        name = " ".join(rng.sample(WORDS, 2)).title()
+        browse_id = f"MPREb_{len(fixtures['albums']):06d}"
+        members, tracklist = [], []
+        for _ in range(rng.randint(8, 14)):
+            tid = 1000 + len(library)
+            title = _title(rng)
+            seconds = rng.randint(120, 420)
+            track = {"Track ID": tid, "Persistent ID": f"{tid:016X}", "Name": title,
+                     "Artist": album_artist, "Album": name, "Album Artist": album_artist,
+                     "Total Time": seconds * 1000 + rng.randint(-1500, 1500)}
+            library[tid] = track
+            members.append(track)
+            correct = _result(f"v{tid:010d}", title.split(" (feat.")[0], album_artist, seconds)
+            decoys = [_result(f"x{tid:07d}{i}", title + " (Live)", album_artist, seconds + rng.randint(40, 90))
+                      for i in range(2)]
+            decoys += [_result(f"y{tid:07d}{i}", _title(rng), _artist(rng), rng.randint(120, 420))
+                       for i in range(3)]
+            roll = rng.random()
+            if roll < miss_rate:
+                continue  # no results anywhere
+            queries = build_queries(track)
+            if roll < miss_rate + hard_rate and len(queries) > 1:
+                fixtures["search"][fixture_key(queries[0], "songs")] = decoys
+                fixtures["search"][fixture_key(queries[1], "songs")] = [correct] + decoys
+            else:
+                fixtures["search"][fixture_key(queries[0], "songs")] = decoys[:2] + [correct] + decoys[2:]
+            tracklist.append(dict(correct, isAvailable=True))
+        fixtures["search"][fixture_key(f"{name} {album_artist}", "albums")] = [
+            {"browseId": browse_id, "title": name, "artists": [{"name": album_artist}], "resultType": "album"}]
+        fixtures["albums"][browse_id] = {"title": name, "tracks": tracklist}
+        return members
+
+    def fresh_tracks():
+        while True:
+            yield from album()
+
+    fresh = fresh_tracks()
+    shared_n = round(tracks * overlap)
+    shared_pool = [next(fresh) for _ in range(shared_n * 2)]
+    plist_playlists = []
+    for p in range(playlists):
+        members = rng.sample(shared_pool, shared_n) + [next(fresh) for _ in range(tracks - shared_n)]
+        rng.shuffle(members)
+        plist_playlists.append({"Name": f"Bench Playlist {p + 1:03d}",
+                                "Playlist Items": [{"Track ID": t["Track ID"]} for t in members]})
+    plist = {"Major Version": 1, "Minor Version": 1,
+             "Tracks": {str(tid): t for tid, t in library.items()}, "Playlists": plist_playlists}
+    return plist, fixtures
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": round(float(p50), 4), "p95": round(float(p95), 4), "p99": round(float(p99), 4)}
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def _load_replay(path: str, **kwargs) -> ReplayClient:
+    return ReplayClient.from_file(path, **kwargs)
+
+class ReplayServer(BaseManager):
+    """Serves a ReplayClient from its own process, so the fixtures stay out of the pipeline's memory."""
+
+ReplayServer.register("ReplayClient", _load_replay)
+
+def _pipeline_child(rundir: str, client, settings: dict, verbose: bool, conn):
+    """
+    Runs import_music.main() in a fresh process against `client` (a ReplayServer
+    proxy) and sends back its timings and peak RSS. Nothing else lives in this
+    process, so the RSS high-water mark is the pipeline's own.
+    """
+    # import_music opens its state databases relative to the working directory at
+    # import time, so it must first be imported from inside the run directory.
+    os.chdir(rundir)
+    import import_music as im
+    if settings["read_rate"]:
+        im._read_limiter = im.AdaptiveLimiter("read", settings["read_rate"], im.SEARCH_WORKERS)
+    if settings["write_rate"]:
+        im._write_limiter = im.AdaptiveLimiter("write", settings["write_rate"], im.WRITE_WORKERS)
+    im.set_client(client)
+
+    # Per track: submitted (playlist handed to the match pool), started (a worker
+    # picked it up, alone or in its album group) and done. Latency is started -> done,
+    # so it does not grow with how far down the queue a track sat; that is queue_waits.
+    latencies: List[float] = []
+    queue_waits: List[float] = []
+    submitted: Dict[str, float] = {}
+    started: Dict[str, float] = {}
+    seen = set()
+    submit, match_journaled, resolve_album_group = im.submit_playlist, im._match_journaled, im._resolve_album_group
+
+    def finished(key: str):
+        if key in started:
+            latencies.append(time.perf_counter() - started[key])
+            queue_waits.append(started[key] - submitted[key])
+
+    def timed_submit(tracks: List[dict]):
+        now = time.perf_counter()
+        for t in tracks:
+            submitted.setdefault(im.track_key(t), now)
+        futures = submit(tracks)
+        for t, fut in zip(tracks, futures):
+            if id(fut) not in seen:
+                seen.add(id(fut))
+                fut.add_done_callback(lambda _, k=im.track_key(t): finished(k))
+        return futures
+
+    def timed_match(key: str, track: dict):
+        started.setdefault(key, time.perf_counter())
+        return match_journaled(key, track)
+
+    def timed_album_group(album: str, album_artist: str, members: list):
+        now = time.perf_counter()
+        for key, _, _ in members:
+            started.setdefault(key, now)
+        return resolve_album_group(album, album_artist, members)
+
+    im.submit_playlist = timed_submit
+    im._match_journaled = timed_match
+    im._resolve_album_group = timed_album_group
+    out = sys.stdout if verbose else io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(out):
+        im.main()
+    elapsed = time.perf_counter() - start
+    conn.send({
+        "seconds": elapsed,
+        "unique_tracks": len(seen),
+        "latencies": latencies,
+        "queue_waits": queue_waits,
+        "peak_rss_mb": _peak_rss_mb(),
+        "stages": im._metrics.summary()["stages"],
+        "settings": {"search_workers": im.SEARCH_WORKERS, "read_rate": im._read_limiter.max_rate,
+                     "write_rate": im._write_limiter.max_rate, "album_batching": im.ALBUM_BATCHING,
+                     "speculative_queries": im.SPECULATIVE_QUERIES, "pipeline_depth": im.PIPELINE_DEPTH},
+    })
+    conn.close()
+
+def generate(args, gendir: Path, rundir: Path) -> Path:
+    """Writes the library to rundir/playlists and returns the path of its fixtures file."""
+    cwd = os.getcwd()
+    gendir.mkdir()
+    os.chdir(gendir)  # keeps this import's state databases out of the run directory
+    try:
+        import import_music as im
+        plist, fixtures = make_library(args.playlists, args.tracks, args.overlap,
+                                       args.miss_rate, args.hard_rate, args.seed, im.build_queries)
+    finally:
+        os.chdir(cwd)
+    (rundir / "playlists").mkdir(parents=True)
+    with open(rundir / "playlists" / "library.xml", "wb") as f:
+        plistlib.dump(plist, f)
+    fixtures_file = gendir / "fixtures.json"
+    fixtures_file.write_text(json.dumps(fixtures), encoding="utf-8")
+    return fixtures_file
+
+def run(args) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="bench_pipeline_"))
+    rundir = workdir / "run"
+    # Fresh interpreters: the child must not inherit this process's memory.
+    ctx = multiprocessing.get_context("spawn")
+    try:
+        fixtures_file = generate(args, workdir / "gen", rundir)
+        with ReplayServer(ctx=ctx) as server:
+            client = server.ReplayClient(str(fixtures_file), latency=args.latency, jitter=args.jitter,
+                                         error_rate=args.error_rate, seed=args.seed)
+            receiver, sender = ctx.Pipe(duplex=False)
+            settings = {"read_rate": args.read_rate, "write_rate": args.write_rate}
+            child = ctx.Process(target=_pipeline_child, args=(str(rundir), client, settings, args.verbose, sender),
+                                name="bench-pipeline")
+            child.start()
+            sender.close()
+            try:
+                child_result = receiver.recv()
+            except EOFError:
+                child.join()
+                raise SystemExit(f"The pipeline process failed (exit code {child.exitcode}).")
+            child.join()
+            calls_by_method = client.call_counts()
+
+        statuses = Counter()
+        summary = rundir / "reports" / "all_playlists_summary.csv"
+        if summary.exists():
+            with open(summary, newline="", encoding="utf-8") as f:
+                statuses.update(row["Status"] for row in csv.DictReader(f))
+    finally:
+        if args.keep:
+            print(f"Scratch directory kept: {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    total = args.playlists * args.tracks
+    unique = child_result["unique_tracks"]
+    elapsed = child_result["seconds"]
+    calls = sum(calls_by_method.values())
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "verbose", "keep")},
+        "settings": child_result["settings"],
+        "tracks": total,
+        "unique_tracks": unique,
+        "seconds": round(elapsed, 3),
+        "tracks_per_sec": round(total / elapsed, 2),
+        "unique_tracks_per_sec": round(unique / elapsed, 2),
+        "api_calls": calls,
+        "api_calls_per_track": round(calls / total, 3) if total else None,
+        "api_calls_per_unique_track": round(calls / unique, 3) if unique else None,
+        "api_calls_by_method": calls_by_method,
+        "track_latency_sec": _percentiles(child_result["latencies"]),
+        "track_queue_wait_sec": _percentiles(child_result["queue_waits"]),
+        "peak_rss_mb": child_result["peak_rss_mb"],
+        "stage_seconds": {name: st["total_seconds"] for name, st in child_result["stages"].items()},
+        "statuses": dict(statuses),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--playlists", type=int, default=10)
+    parser.add_argument("--tracks", type=int, default=100, help="tracks per playlist")
+    parser.add_argument("--overlap", type=float, default=0.3, help="share of each playlist shared with others")
+    parser.add_argument("--miss-rate", type=float, default=0.05, help="share of tracks with no results")
+    parser.add_argument("--hard-rate", type=float, default=0.15,
+                        help="share of tracks only found by a later query variant")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per API call")
+    parser.add_argument("--jitter", type=float, default=0.02, help="extra random seconds per API call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of API calls failing with 429/503")
+    parser.add_argument("--read-rate", type=float, help="override READ_RATE")
+    parser.add_argument("--write-rate", type=float, help="override WRITE_RATE")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", type=Path, help="append the result as one JSON line to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(json.dumps(result, indent=2))
+    if args.out:
+        with open(args.out, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result) + "\n")
+
+if __name__ == "__main__":
+    main()
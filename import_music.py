@@ -1,12 +1,26 @@
 import os
-import plistlib
 import re
 import csv
+import json
+import queue
+import random
+import sqlite3
+import threading
+import time
+import xml.etree.ElementTree as ET
+from bisect import bisect_left
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 from pathlib import Path
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import List, Tuple
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Protocol, Tuple
+import requests
 from unidecode import unidecode
-from rapidfuzz import fuzz
+import numpy as np
+from rapidfuzz import fuzz, process
 from ytmusicapi import YTMusic, OAuthCredentials
 
 PLAYLISTS_DIR = Path("playlists")          
@@ -18,44 +32,364 @@ ACCEPT_TITLE_MIN = 88
 ACCEPT_ARTIST_MIN = 75
 ACCEPT_COMBINED_MIN = 85
 SEARCH_RESULT_LIMIT_PER_QUERY = 6
+CANDIDATE_NORM_CACHE_SIZE = 65536  # memoized candidate title/artist normalizations
+# Candidates whose length differs from the source track's Total Time by more than
+# max(DURATION_TOLERANCE seconds, DURATION_TOLERANCE_RATIO of the track) are not
+# scored at all; ones within DURATION_MATCH seconds win ties and may accept early.
+DURATION_TOLERANCE = 15
+DURATION_TOLERANCE_RATIO = 0.10
+DURATION_MATCH = 3
 ADD_CHUNK = 90
+SEARCH_WORKERS = 8  # tracks matched concurrently (in-flight searches)
+# Issue all of a track's query variants at once instead of one after another.
+# Cuts per-track latency to about one round-trip, at the price of searches that
+# an early accept would have skipped (unstarted ones are cancelled).
+SPECULATIVE_QUERIES = False
+# Resolve tracks that share an album with one album search + get_album and match
+# them against its tracklist locally; per-track searches only for leftovers.
+ALBUM_BATCHING = True
+ALBUM_MIN_TRACKS = 3  # smallest group of one album in a playlist worth an album lookup
+ALBUM_LOOKUP_CALLS = 2  # API calls of one album lookup (album search + get_album), shared by its group
+PIPELINE_DEPTH = 2  # playlists that may be matching ahead of the one being written
 DRY_RUN = False  # set True to test without actually adding tracks
+SYNC_EXISTING = True    # only add tracks the target playlist does not already contain
+REMOVE_MISSING = False  # with SYNC_EXISTING, also remove tracks that are not in the source playlist
+
+# Request pacing. Rates are ceilings: the limiters halve rate and concurrency on
+# 429/5xx responses and grow them back additively while calls succeed.
+READ_RATE = 10.0    # max searches / listings per second
+WRITE_RATE = 2.0    # max playlist writes per second
+WRITE_WORKERS = 1
+MAX_RETRIES = 6
+RETRY_BASE_DELAY = 1.0  # seconds, doubled per attempt unless the server sends Retry-After
+RETRY_MAX_DELAY = 60.0
 
 OUTPUT_DIR = Path("reports")
 OUTPUT_DIR.mkdir(exist_ok=True)
 
-yt = YTMusic(
-    OAUTH_FILE,
-    oauth_credentials=OAuthCredentials(
-        client_id=CLIENT_ID,
-        client_secret=CLIENT_SECRET
+# Per-stage timings and counters of the last run, as JSON and as a Prometheus
+# textfile (for node_exporter's textfile collector).
+RUN_SUMMARY_JSON = OUTPUT_DIR / "run_summary.json"
+RUN_SUMMARY_PROM = OUTPUT_DIR / "run_summary.prom"
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)  # seconds
+
+STATE_DIR = Path("state")
+STATE_DIR.mkdir(exist_ok=True)
+
+SEARCH_CACHE_DB = STATE_DIR / "search_cache.sqlite3"
+SEARCH_CACHE_TTL = 14 * 24 * 3600   # seconds a cached search stays valid
+SEARCH_CACHE_MAX_ENTRIES = 200_000  # oldest entries are evicted beyond this
+CACHE_ONLY = False  # set True to answer searches from the cache only (no network)
+
+UNRESOLVED_DB = STATE_DIR / "unresolved.sqlite3"
+UNRESOLVED_TTL = 30 * 24 * 3600  # seconds a NO_RESULT/REVIEW outcome is trusted
+UNRESOLVED_MIN_MISSES = 1        # unresolved runs in a row before a NO_RESULT track is skipped
+UNRESOLVED_MIN_REVIEWS = 2       # same for a track whose last outcome was REVIEW
+RETRY_UNRESOLVED = False         # set True to search known misses again anyway
+
+QUERY_STATS_DB = STATE_DIR / "query_stats.sqlite3"
+ADAPTIVE_QUERIES = True      # reorder/skip query variants by their recorded hit rate
+PLANNER_MIN_SAMPLES = 200    # tries of a step before its hit rate is trusted
+PLANNER_MIN_WIN_RATE = 0.01  # steps that win less often than this are skipped
+PLANNER_EXPLORE = 0.05       # share of tracks that still run the full default plan
+
+CANDIDATES_DB = STATE_DIR / "candidates.sqlite3"
+CANDIDATES_KEPT = 24  # raw candidates stored per track for offline re-scoring (rescore.py)
+
+JOURNAL_DB = STATE_DIR / "journal.sqlite3"
+RESUME = True  # continue an interrupted run from its journal instead of starting over
+
+# Which client serves API calls: "ytmusic" (the real service), "replay" (recorded
+# fixtures from MUSIC_TRANSFER_FIXTURES, see replay_client.py) or "record" (the
+# real service, with responses saved to MUSIC_TRANSFER_FIXTURES at the end).
+BACKEND = os.getenv("MUSIC_TRANSFER_BACKEND", "ytmusic")
+FIXTURES_FILE = os.getenv("MUSIC_TRANSFER_FIXTURES", "fixtures.json")
+REPLAY_LATENCY = float(os.getenv("MUSIC_TRANSFER_LATENCY", "0"))        # seconds per replayed call
+REPLAY_ERROR_RATE = float(os.getenv("MUSIC_TRANSFER_ERROR_RATE", "0"))  # share of replayed calls failing
+
+class RunMetrics:
+    """
+    Instrumentation for one run: a latency histogram and error count per pipeline
+    stage, and labeled counters (API calls, cache lookups, track outcomes).
+    Stages overlap across threads, so their totals add up to more than the wall time.
+    """
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.started = time.time()
+        self._stages: Dict[str, dict] = {}
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], int] = {}
+        self._lock = threading.Lock()
+
+    def begin(self):
+        self.started = time.time()
+
+    def observe(self, stage: str, seconds: float, error: bool = False):
+        with self._lock:
+            s = self._stages.get(stage)
+            if s is None:
+                s = self._stages[stage] = {"count": 0, "errors": 0, "sum": 0.0, "max": 0.0,
+                                           "buckets": [0] * (len(self.buckets) + 1)}
+            s["count"] += 1
+            s["errors"] += error
+            s["sum"] += seconds
+            s["max"] = max(s["max"], seconds)
+            s["buckets"][bisect_left(self.buckets, seconds)] += 1
+
+    @contextmanager
+    def timed(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(stage, time.perf_counter() - start, error=True)
+            raise
+        self.observe(stage, time.perf_counter() - start)
+
+    def timed_iter(self, stage: str, items: Iterable):
+        """Yields from `items`, timing the production of each item as `stage`."""
+        it = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return  # the end of the input is not an item
+            except BaseException:
+                self.observe(stage, time.perf_counter() - start, error=True)
+                raise
+            self.observe(stage, time.perf_counter() - start)
+            yield item
+
+    def count(self, name: str, n: int = 1, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    def _quantile(self, s: dict, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (the max for the last one)."""
+        rank, seen = q * s["count"], 0
+        for bound, n in zip(self.buckets, s["buckets"]):
+            seen += n
+            if seen >= rank:
+                return min(bound, s["max"])
+        return s["max"]
+
+    def summary(self) -> dict:
+        with self._lock:
+            stages = {name: dict(s, buckets=list(s["buckets"])) for name, s in self._stages.items()}
+            counters = dict(self._counters)
+        out_stages = {}
+        for name, s in sorted(stages.items(), key=lambda kv: -kv[1]["sum"]):
+            out_stages[name] = {
+                "count": s["count"], "errors": s["errors"],
+                "total_seconds": round(s["sum"], 3),
+                "mean_seconds": round(s["sum"] / s["count"], 6) if s["count"] else 0.0,
+                "max_seconds": round(s["max"], 6),
+                **{f"p{int(q * 100)}_seconds": round(self._quantile(s, q), 6) for q in (0.5, 0.95, 0.99)},
+                "buckets": {str(b): n for b, n in zip(self.buckets + ("+Inf",), s["buckets"])},
+            }
+        out_counters: Dict[str, Dict[str, int]] = {}
+        lookups: Dict[str, Dict[str, int]] = {}
+        for (name, labels), n in sorted(counters.items()):
+            label = ",".join(f"{k}={v}" for k, v in labels) or "total"
+            out_counters.setdefault(name, {})[label] = n
+            if name == "cache_lookups":
+                d = dict(labels)
+                lookups.setdefault(d["cache"], {})[d["result"]] = n
+        hit_rates = {cache: round(r.get("hit", 0) / sum(r.values()), 4)
+                     for cache, r in lookups.items() if sum(r.values())}
+        finished = time.time()
+        return {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started)),
+            "finished": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(finished)),
+            "wall_seconds": round(finished - self.started, 3),
+            "stages": out_stages,
+            "counters": out_counters,
+            "cache_hit_rates": hit_rates,
+        }
+
+    def prometheus(self, prefix: str = "music_transfer") -> str:
+        """The same data in the Prometheus text exposition format."""
+        with self._lock:
+            stages = {name: dict(s, buckets=list(s["buckets"])) for name, s in self._stages.items()}
+            counters = dict(self._counters)
+
+        def esc(v) -> str:
+            return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        lines = [f"# HELP {prefix}_stage_seconds Time spent per pipeline stage.",
+                 f"# TYPE {prefix}_stage_seconds histogram"]
+        for name, s in sorted(stages.items()):
+            cum = 0
+            for bound, n in zip(self.buckets + ("+Inf",), s["buckets"]):
+                cum += n
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{esc(name)}",le="{bound}"}} {cum}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{esc(name)}"}} {s["sum"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{esc(name)}"}} {s["count"]}')
+        lines += [f"# HELP {prefix}_stage_errors_total Stage executions that raised.",
+                  f"# TYPE {prefix}_stage_errors_total counter"]
+        lines += [f'{prefix}_stage_errors_total{{stage="{esc(name)}"}} {s["errors"]}'
+                  for name, s in sorted(stages.items())]
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            for (n_name, labels), n in sorted(counters.items()):
+                if n_name == name:
+                    label = ",".join(f'{k}="{esc(v)}"' for k, v in labels)
+                    lines.append(f"{prefix}_{name}_total{{{label}}} {n}" if label else f"{prefix}_{name}_total {n}")
+        lines += [f"# TYPE {prefix}_run_started_timestamp_seconds gauge",
+                  f"{prefix}_run_started_timestamp_seconds {self.started:.3f}",
+                  f"# TYPE {prefix}_run_seconds gauge",
+                  f"{prefix}_run_seconds {time.time() - self.started:.3f}"]
+        return "\n".join(lines) + "\n"
+
+_metrics = RunMetrics()
+
+class MusicClient(Protocol):
+    """The part of the YTMusic API this script uses; any backend must provide it."""
+
+    def search(self, query: str, filter: Optional[str] = None) -> List[dict]: ...
+    def get_album(self, browseId: str) -> dict: ...
+    def get_library_playlists(self, limit: Optional[int] = 25) -> List[dict]: ...
+    def get_playlist(self, playlistId: str, limit: Optional[int] = 100) -> dict: ...
+    def create_playlist(self, title: str, description: str, privacy_status: str = "PRIVATE") -> str: ...
+    def add_playlist_items(self, playlistId: str, videoIds: List[str]): ...
+    def remove_playlist_items(self, playlistId: str, videos: List[dict]): ...
+
+def _make_client() -> MusicClient:
+    if BACKEND == "replay":
+        from replay_client import ReplayClient
+        return ReplayClient.from_file(FIXTURES_FILE, latency=REPLAY_LATENCY, error_rate=REPLAY_ERROR_RATE)
+    client = YTMusic(
+        OAUTH_FILE,
+        oauth_credentials=OAuthCredentials(
+            client_id=CLIENT_ID,
+            client_secret=CLIENT_SECRET
+        )
     )
-)
+    if BACKEND == "record":
+        from replay_client import RecordingClient
+        return RecordingClient(client, FIXTURES_FILE)
+    return client
+
+class _LazyClient:
+    """Builds the client on first use, so offline tools (rescore.py) never need OAuth."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def set(self, client: MusicClient):
+        with self._lock:
+            self._client = client
+
+    def __getattr__(self, name):
+        with self._lock:
+            if self._client is None:
+                self._client = self._factory()
+        return getattr(self._client, name)
+
+yt = _LazyClient(_make_client)
+
+def set_client(client: MusicClient):
+    """Routes every API call of this module to `client` (tests, benchmarks)."""
+    yt.set(client)
 
 _feat_pattern = re.compile(r'\s*(\(|\[)?feat\.?[^)\]]*(\)|\])?', re.IGNORECASE)
 
-def load_plist(path: Path):
-    with open(path, "rb") as f:
-        return plistlib.load(f)
-
-def extract_playlist_entries(root) -> List[dict]:
-    """
-    Returns a list of (playlist_name, track_dicts) for every playlist in this file.
-    (Usually you expect just one, but we allow >1 for robustness.)
-    """
-    tracks_dict = root.get("Tracks", {})
-    playlists = []
-    for plist in root.get("Playlists", []):
-        name = plist.get("Name")
-        t_ids = [item["Track ID"] for item in plist.get("Playlist Items", [])]
-        track_objs = []
-        for tid in t_ids:
-            t = tracks_dict.get(str(tid)) or tracks_dict.get(tid)
-            if t:
-                track_objs.append(t)
-        if name and track_objs:
-            playlists.append({"name": name, "tracks": track_objs})
-    return playlists
+# Only these fields of each track survive parsing; everything else the library
+# export carries (play counts, file locations, artwork, ...) is dropped.
+TRACK_FIELDS = ("Track ID", "Persistent ID", "Name", "Artist", "Album", "Album Artist", "Total Time")
+
+def _plist_scalar(elem):
+    tag = elem.tag
+    if tag == "integer":
+        return int(elem.text or 0)
+    if tag == "real":
+        return float(elem.text or 0)
+    if tag == "true":
+        return True
+    if tag == "false":
+        return False
+    return elem.text or ""
+
+def _plist_pairs(dict_elem):
+    """Yields (key, value_element) pairs of a plist <dict> element."""
+    key = None
+    for child in dict_elem:
+        if child.tag == "key":
+            key = child.text or ""
+        elif key is not None:
+            yield key, child
+            key = None
+
+def _compact_track(track_elem) -> dict:
+    track = {}
+    for key, value in _plist_pairs(track_elem):
+        if key in TRACK_FIELDS:
+            track[key] = _plist_scalar(value)
+    return track
+
+def _playlist_track_ids(playlist_elem) -> Tuple[str, List[int]]:
+    name, t_ids = None, []
+    for key, value in _plist_pairs(playlist_elem):
+        if key == "Name":
+            name = value.text or ""
+        elif key == "Playlist Items":
+            for item in value:
+                for item_key, item_value in _plist_pairs(item):
+                    if item_key == "Track ID":
+                        t_ids.append(int(item_value.text or 0))
+    return name, t_ids
+
+def _resolve_playlist(name: str, t_ids: List[int], tracks: Dict[int, dict]) -> Iterator[dict]:
+    track_objs = [tracks[tid] for tid in t_ids if tid in tracks]
+    if name and track_objs:
+        yield {"name": name, "tracks": track_objs}
+
+def iter_plist_playlists(path: Path) -> Iterator[dict]:
+    """
+    Streams an iTunes / Apple Music XML plist and yields {"name", "tracks"} for every
+    playlist in it, in file order.
+
+    The file is walked with iterparse instead of being loaded whole: each track entry
+    is reduced to TRACK_FIELDS as soon as it has been read, and each playlist is
+    yielded and discarded before the next one is parsed. Resident memory is the compact
+    track table plus the playlist currently being yielded.
+    """
+    tracks: Dict[int, dict] = {}
+    stack = []          # open elements, stack[0] is <plist>
+    top_key = None      # key of the top-level dict entry we are inside
+    tracks_done = False
+    pending: List[Tuple[str, List[int]]] = []
+    for event, elem in ET.iterparse(str(path), events=("start", "end")):
+        if event == "start":
+            stack.append(elem)
+            continue
+        stack.pop()
+        depth = len(stack)  # depth of elem's parent: 2 = top-level dict
+        if depth == 2 and elem.tag == "key":
+            top_key = elem.text
+        elif depth == 3 and top_key in ("Tracks", "Playlists"):
+            if elem.tag == "dict" and top_key == "Tracks":
+                track = _compact_track(elem)
+                if "Track ID" in track:
+                    tracks[track["Track ID"]] = track
+            elif elem.tag == "dict":
+                name, t_ids = _playlist_track_ids(elem)
+                if not tracks_done:
+                    # Playlists ahead of the track table (not how Apple writes it,
+                    # but valid plist): hold the IDs until the tracks are known.
+                    pending.append((name, t_ids))
+                else:
+                    yield from _resolve_playlist(name, t_ids, tracks)
+            # Finished entries are dropped from the tree so it never grows past one entry.
+            stack[-1].remove(elem)
+        elif depth == 2 and top_key == "Tracks" and elem.tag == "dict":
+            tracks_done = True
+    for name, t_ids in pending:
+        yield from _resolve_playlist(name, t_ids, tracks)
 
 def normalize_title(title: str) -> str:
     return unidecode(title).strip()
@@ -71,77 +405,1018 @@ def primary_artist(artist_field: str) -> str:
         return parts[0].strip()
     return artist_field.strip()
 
-def build_queries(track: dict) -> List[str]:
+def build_query_plan(track: dict) -> List[Tuple[str, str]]:
+    """(variant, query) pairs in default order; the variant names feed the QueryPlanner."""
     title = (track.get("Name") or "").strip()
     artist = (track.get("Artist") or "").strip()
     bt = base_title(title)
-    queries = [f"{title} {artist}"]
+    queries = [("title_artist", f"{title} {artist}")]
     if bt.lower() != title.lower():
-        queries.append(f"{bt} {artist}")
-    queries.append(title)
+        queries.append(("base_artist", f"{bt} {artist}"))
+    queries.append(("title", title))
     if bt.lower() != title.lower():
-        queries.append(bt)
+        queries.append(("base", bt))
     uniq, seen = [], set()
-    for q in queries:
+    for variant, q in queries:
         key = q.lower()
         if key and key not in seen:
             seen.add(key)
-            uniq.append(q)
+            uniq.append((variant, q))
     return uniq
 
-def score_candidate(track: dict, candidate: dict) -> Tuple[float, float, float]:
+def build_queries(track: dict) -> List[str]:
+    return [q for _, q in build_query_plan(track)]
+
+@dataclass(frozen=True)
+class TrackFeatures:
+    """Source-track side of score_candidate, normalized once per track."""
+    t_norm: str
+    bt_norm: str
+    a_norm: str
+    duration: Optional[float] = None  # seconds, from the plist's Total Time
+
+def track_features(track: dict) -> TrackFeatures:
     title = track.get("Name", "")
     artist = track.get("Artist", "")
+    total_ms = track.get("Total Time")
+    return TrackFeatures(
+        t_norm=normalize_title(title).lower(),
+        bt_norm=normalize_title(base_title(title)).lower(),
+        a_norm=normalize_title(primary_artist(artist)).lower(),
+        duration=total_ms / 1000 if total_ms else None,
+    )
+
+def duration_fit(features: TrackFeatures, candidate: dict) -> Optional[bool]:
+    """
+    None when the candidate's length rules it out, True when it is within
+    DURATION_MATCH seconds, False otherwise (including when either length is unknown).
+    """
+    cand = candidate.get("duration_seconds")
+    if not features.duration or not cand:
+        return False
+    diff = abs(features.duration - cand)
+    if diff > max(DURATION_TOLERANCE, DURATION_TOLERANCE_RATIO * features.duration):
+        return None
+    return diff <= DURATION_MATCH
+
+# Candidate strings recur across queries, tracks and playlists; memoize their
+# normalization by the raw string.
+@lru_cache(maxsize=CANDIDATE_NORM_CACHE_SIZE)
+def _candidate_title_norm(cand_title: str) -> str:
+    return normalize_title(cand_title).lower()
+
+@lru_cache(maxsize=CANDIDATE_NORM_CACHE_SIZE)
+def _candidate_artist_norm(cand_artists: str) -> str:
+    return normalize_title(primary_artist(cand_artists)).lower()
+
+def score_features(features: TrackFeatures, candidate: dict) -> Tuple[float, float, float]:
     cand_title = candidate.get("title", "")
     cand_artists = " ".join(a['name'] for a in candidate.get("artists", []) or [])
 
-    t_norm = normalize_title(title).lower()
-    bt_norm = normalize_title(base_title(title)).lower()
-    c_norm = normalize_title(cand_title).lower()
-    a_norm = normalize_title(primary_artist(artist)).lower()
-    cand_a_norm = normalize_title(primary_artist(cand_artists)).lower()
+    c_norm = _candidate_title_norm(cand_title)
+    cand_a_norm = _candidate_artist_norm(cand_artists)
 
     title_score = max(
-        fuzz.token_set_ratio(t_norm, c_norm),
-        fuzz.token_set_ratio(bt_norm, c_norm)
+        fuzz.token_set_ratio(features.t_norm, c_norm),
+        fuzz.token_set_ratio(features.bt_norm, c_norm)
     )
-    artist_score = fuzz.partial_ratio(a_norm, cand_a_norm)
+    artist_score = fuzz.partial_ratio(features.a_norm, cand_a_norm)
     combined = 0.6 * title_score + 0.4 * artist_score
     return title_score, artist_score, combined
 
-def search_and_match(track: dict):
-    queries = build_queries(track)
-    best = None
-    # store as (title_score, artist_score, combined)
-    best_scores = (0.0, 0.0, 0.0)
+def score_candidate(track: dict, candidate: dict) -> Tuple[float, float, float]:
+    return score_features(track_features(track), candidate)
+
+def score_pairs(features: List[TrackFeatures], candidates: List[dict], workers: int = 1) -> np.ndarray:
+    """
+    Batch form of score_features: row i scores candidates[i] against features[i].
+    Returns an (n, 3) float64 array of (title, artist, combined) computed with the
+    same scorers and weights, so every row equals score_features exactly. Each
+    scorer runs once over all pairs in rapidfuzz's C loop (`workers` threads).
+    Only worth it for multi-track windows (album groups, rescore, tuning): for a
+    single search response the per-call setup costs more than score_features.
+    """
+    if not candidates:
+        return np.zeros((0, 3))
+    c_norms = [_candidate_title_norm(c.get("title", "")) for c in candidates]
+    ca_norms = [_candidate_artist_norm(" ".join(a['name'] for a in c.get("artists", []) or []))
+                for c in candidates]
+    pairwise = dict(dtype=np.float64, workers=workers)
+    title = np.maximum(
+        process.cpdist([f.t_norm for f in features], c_norms, scorer=fuzz.token_set_ratio, **pairwise),
+        process.cpdist([f.bt_norm for f in features], c_norms, scorer=fuzz.token_set_ratio, **pairwise),
+    )
+    artist = process.cpdist([f.a_norm for f in features], ca_norms, scorer=fuzz.partial_ratio, **pairwise)
+    return np.column_stack((title, artist, 0.6 * title + 0.4 * artist))
+
+def _preference(features: TrackFeatures, candidate: dict) -> float:
+    """Tie-break bonus on top of the combined score: songs over videos, right length."""
+    bonus = 0.5 if candidate.get("resultType") == "song" else 0.0
+    if duration_fit(features, candidate):
+        bonus += 0.5
+    return bonus
+
+def best_candidates_batch(features: List[TrackFeatures], candidates: List[List[dict]],
+                          workers: int = -1) -> List[Tuple[Optional[dict], Tuple[float, float, float]]]:
+    """
+    Scores a window of tracks, each with its own candidate list, in one score_pairs
+    call and picks each track's best candidate: highest combined score with the
+    same song and duration preferences as search_and_match, first one on ties.
+    Candidates ruled out by duration_fit are skipped.
+    """
+    kept = [[c for c in cands if duration_fit(f, c) is not None] for f, cands in zip(features, candidates)]
+    owners = np.repeat(np.arange(len(features)), [len(c) for c in kept])
+    flat = [c for cands in kept for c in cands]
+    if not flat:
+        return [(None, (0.0, 0.0, 0.0)) for _ in features]
+    with _metrics.timed("scoring_batch"):
+        scores = score_pairs([features[i] for i in owners], flat, workers=workers)
+    adjusted = scores[:, 2] + np.array([_preference(features[i], c) for i, c in zip(owners, flat)])
+    # Per-track argmax: sort by (track, -adjusted, position) and take each track's first row.
+    order = np.lexsort((np.arange(len(flat)), -adjusted, owners))
+    firsts = order[np.r_[True, owners[order][1:] != owners[order][:-1]]]
+    results: List[Tuple[Optional[dict], Tuple[float, float, float]]] = [(None, (0.0, 0.0, 0.0))] * len(features)
+    for row in firsts:
+        ts, as_, comb = scores[row]
+        results[owners[row]] = (flat[row], (float(ts), float(as_), float(comb)))
+    return results
+
+def _error_status(exc: Exception) -> Tuple[Optional[int], Optional[float]]:
+    """HTTP status and Retry-After (seconds) carried by a client exception, if any."""
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None:
+        # ytmusicapi only keeps the status in the message: "Server returned HTTP 429: ..."
+        m = re.search(r'HTTP (\d{3})', str(exc))
+        status = int(m.group(1)) if m else None
+    retry_after = None
+    header = getattr(response, "headers", {}).get("Retry-After") if response is not None else None
+    if header:
+        try:
+            retry_after = float(header)
+        except ValueError:
+            try:
+                retry_after = parsedate_to_datetime(header).timestamp() - time.time()
+            except (TypeError, ValueError):
+                retry_after = None
+        if retry_after is not None:
+            retry_after = max(0.0, retry_after)
+    return status, retry_after
+
+def _is_retryable(exc: Exception, status: Optional[int]) -> bool:
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+    return status is not None and (status == 429 or 500 <= status < 600)
+
+class AdaptiveLimiter:
+    """
+    Token bucket plus an AIMD concurrency window shared by every call of one kind.
+
+    Each successful window of calls adds one slot of concurrency and a tenth of
+    `max_rate` back; a 429/5xx halves both and pauses all callers for Retry-After
+    (or an exponential backoff) before the call is retried.
+    """
+
+    def __init__(self, name: str, max_rate: float, max_concurrency: int):
+        self.name = name
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.rate = max_rate
+        self.limit = float(max_concurrency)
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+        self._in_flight = 0
+        self._successes = 0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def _refill(self, now: float):
+        burst = max(1.0, self.rate)
+        self._tokens = min(burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _acquire(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._in_flight >= int(self.limit):
+                    wait = None  # until a release
+                elif self._tokens < 1:
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    self._tokens -= 1
+                    self._in_flight += 1
+                    return
+                self._cond.wait(wait)
+
+    def _release(self, throttled_for: Optional[float] = None, ok: bool = True):
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if throttled_for is not None:
+                self._successes = 0
+                # Many in-flight calls fail together on a 429; only the first one
+                # of a burst shrinks the window.
+                if now >= self._paused_until:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.rate = max(self.max_rate / 20, self.rate / 2)
+                self._paused_until = max(self._paused_until, now + throttled_for)
+                print(f"[THROTTLED] {self.name}: backing off {throttled_for:.1f}s "
+                      f"(concurrency {int(self.limit)}, {self.rate:.1f}/s)")
+            elif ok:
+                self._successes += 1
+                if self._successes >= self.limit:
+                    self._successes = 0
+                    self.limit = min(float(self.max_concurrency), self.limit + 1)
+                    self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+            self._cond.notify_all()
+
+    def call(self, fn, *args, **kwargs):
+        """Runs fn under the limiter, retrying throttled and transient failures."""
+        method = getattr(fn, "__name__", "call")
+        for attempt in range(MAX_RETRIES + 1):
+            self._acquire()
+            _metrics.count("api_calls", method=method)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                status, retry_after = _error_status(e)
+                if attempt == MAX_RETRIES or not _is_retryable(e, status):
+                    self._release(ok=False)
+                    _metrics.count("api_errors", method=method, status=str(status or "none"))
+                    raise
+                _metrics.count("api_retries", method=method, status=str(status or "none"))
+                if retry_after is None:
+                    retry_after = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+                    retry_after *= random.uniform(0.5, 1.0)
+                self._release(throttled_for=retry_after)
+                continue
+            self._release()
+            return result
+
+_read_limiter = AdaptiveLimiter("read", READ_RATE, SEARCH_WORKERS)
+_write_limiter = AdaptiveLimiter("write", WRITE_RATE, WRITE_WORKERS)
+
+def _open_state_db(path: Path, schema: str) -> sqlite3.Connection:
+    """
+    Autocommit connection to a STATE_DIR database in WAL mode, with `schema`
+    applied. It is shared across threads; its owner serializes access with a lock.
+    """
+    conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(schema)
+    return conn
+
+def _slim(item: dict) -> dict:
+    """A response item without its thumbnails, which are bulky and never used."""
+    return {k: v for k, v in item.items() if k != "thumbnails"}
+
+class SearchCache:
+    """
+    SQLite store of raw yt.search responses keyed by search_key(). Entries older
+    than `ttl` seconds are ignored and purged; past `max_entries` the oldest go first.
+    """
+
+    def __init__(self, path: Path, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._conn = _open_state_db(
+            path,
+            "CREATE TABLE IF NOT EXISTS searches ("
+            " key TEXT PRIMARY KEY, results TEXT NOT NULL, stored_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS searches_stored_at ON searches(stored_at);"
+        )
+
+    def get(self, key: str) -> Optional[List[dict]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT results FROM searches WHERE key = ? AND stored_at >= ?",
+                (key, time.time() - self.ttl),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, results: List[dict]):
+        slim = [_slim(r) for r in results]
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO searches (key, results, stored_at) VALUES (?, ?, ?)",
+                (key, json.dumps(slim), time.time()),
+            )
+            self._puts += 1
+            if self._puts % 1000 == 0:
+                self._evict()
+
+    def _evict(self):
+        self._conn.execute("DELETE FROM searches WHERE stored_at < ?", (time.time() - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM searches WHERE key IN ("
+            " SELECT key FROM searches ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+_search_cache = SearchCache(SEARCH_CACHE_DB, SEARCH_CACHE_TTL, SEARCH_CACHE_MAX_ENTRIES)
+
+def search_key(query: str, filter: Optional[str] = None) -> str:
+    """Canonical cache key: transliterated, lower-cased, whitespace-collapsed query plus filter."""
+    canon = re.sub(r'\s+', ' ', unidecode(query)).strip().lower()
+    return f"{filter or ''}\x1f{canon}"
+
+# What cached_search returns under CACHE_ONLY for a search that is not cached:
+# empty like a real miss, but told apart by identity, so an unknown outcome is
+# never remembered as a known one.
+NOT_CACHED: List[dict] = []
+
+# Searches currently on the wire, by search_key(). Identical searches that come
+# in meanwhile wait for the same response instead of issuing their own.
+_inflight_searches: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+def cached_search(query: str, filter: Optional[str] = None) -> List[dict]:
+    # "search_songs" is the filtered search, "search_all" the unfiltered fallback.
+    with _metrics.timed(f"search_{filter or 'all'}"):
+        return _cached_search(query, filter)
+
+def _cached_search(query: str, filter: Optional[str]) -> List[dict]:
+    key = search_key(query, filter)
+    results = _search_cache.get(key)
+    if results is not None:
+        _metrics.count("cache_lookups", cache="search", result="hit")
+        return results
+    if CACHE_ONLY:
+        _metrics.count("cache_lookups", cache="search", result="miss")
+        return NOT_CACHED
+    with _inflight_lock:
+        shared = _inflight_searches.get(key)
+        if shared is None:
+            _inflight_searches[key] = own = Future()
+    if shared is not None:
+        _metrics.count("cache_lookups", cache="search", result="shared")
+        return shared.result()
+    try:
+        # A previous owner may have stored the response and left between our cache
+        # miss and our registration; look again before going to the network.
+        results = _search_cache.get(key)
+        if results is not None:
+            _metrics.count("cache_lookups", cache="search", result="hit")
+        else:
+            _metrics.count("cache_lookups", cache="search", result="miss")
+            if filter:
+                results = _read_limiter.call(yt.search, query, filter=filter)
+            else:
+                results = _read_limiter.call(yt.search, query)
+            _search_cache.put(key, results)
+    except BaseException as e:
+        own.set_exception(e)
+        raise
+    else:
+        own.set_result(results)
+        return results
+    finally:
+        with _inflight_lock:
+            del _inflight_searches[key]
+
+class UnresolvedCache:
+    """
+    Negative cache of tracks whose search ended in NO_RESULT or REVIEW, keyed by
+    track_identity(). Within UNRESOLVED_TTL, and once a track has been unresolved
+    UNRESOLVED_MIN_MISSES runs in a row (UNRESOLVED_MIN_REVIEWS if it last came
+    back REVIEW), its last outcome is reused instead of running every query variant
+    again. RETRY_UNRESOLVED bypasses it.
+    """
+
+    def __init__(self, path: Path):
+        self._lock = threading.Lock()
+        self._conn = _open_state_db(
+            path,
+            "CREATE TABLE IF NOT EXISTS unresolved ("
+            " identity TEXT PRIMARY KEY, match TEXT, title_score REAL, artist_score REAL,"
+            " combined_score REAL, misses INTEGER NOT NULL, stored_at REAL NOT NULL)"
+        )
+
+    def get(self, identity: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT match, title_score, artist_score, combined_score FROM unresolved"
+                " WHERE identity = ? AND misses >= (CASE WHEN match IS NULL THEN ? ELSE ? END)"
+                " AND stored_at >= ?",
+                (identity, UNRESOLVED_MIN_MISSES, UNRESOLVED_MIN_REVIEWS,
+                 time.time() - UNRESOLVED_TTL)).fetchone()
+        if row is None:
+            return None
+        return (json.loads(row[0]) if row[0] else None), (row[1], row[2], row[3])
+
+    def record(self, identity: str, match: Optional[dict], scores: Tuple[float, float, float]):
+        slim = _slim(match) if match else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO unresolved VALUES (?, ?, ?, ?, ?, 1, ?)"
+                " ON CONFLICT(identity) DO UPDATE SET match = excluded.match,"
+                " title_score = excluded.title_score, artist_score = excluded.artist_score,"
+                " combined_score = excluded.combined_score, misses = misses + 1,"
+                " stored_at = excluded.stored_at",
+                (identity, json.dumps(slim) if slim else None, *scores, time.time()))
+
+    def forget(self, identity: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM unresolved WHERE identity = ?", (identity,))
+
+_unresolved = UnresolvedCache(UNRESOLVED_DB)
+
+class QueryPlanner:
+    """
+    Persistent hit-rate statistics per search step, a step being a query variant
+    from build_query_plan with filter "songs" or the unfiltered fallback "all".
+    Once a step has PLANNER_MIN_SAMPLES tries, variants are ordered by how often
+    they produce the accepted match and steps below PLANNER_MIN_WIN_RATE are
+    skipped. A PLANNER_EXPLORE share of tracks keeps using the full default plan
+    so the statistics stay current.
+    """
+
+    def __init__(self, path: Path):
+        self._lock = threading.Lock()
+        self._dirty = 0
+        self._conn = _open_state_db(
+            path,
+            "CREATE TABLE IF NOT EXISTS steps ("
+            " variant TEXT, filter TEXT, tries INTEGER NOT NULL, wins INTEGER NOT NULL,"
+            " PRIMARY KEY (variant, filter))"
+        )
+        self.stats: Dict[Tuple[str, str], List[int]] = {
+            (v, f): [tries, wins] for v, f, tries, wins in self._conn.execute("SELECT * FROM steps")
+        }
+
+    def _rate(self, step: Tuple[str, str]) -> Optional[float]:
+        tries, wins = self.stats.get(step, (0, 0))
+        return wins / tries if tries >= PLANNER_MIN_SAMPLES else None
+
+    def _useful(self, step: Tuple[str, str]) -> bool:
+        rate = self._rate(step)
+        return rate is None or rate >= PLANNER_MIN_WIN_RATE
+
+    def plan(self, queries: List[Tuple[str, str]]) -> List[Tuple[str, str, bool]]:
+        """(variant, query, try_unfiltered_fallback) steps to run for one track."""
+        if not ADAPTIVE_QUERIES or random.random() < PLANNER_EXPLORE:
+            return [(v, q, True) for v, q in queries]
+        with self._lock:
+            def score(item):
+                rate = self._rate((item[1][0], "songs"))
+                # Unproven variants keep their default position ahead of proven losers.
+                return -(rate if rate is not None else 1.0), item[0]
+            ordered = [vq for _, vq in sorted(enumerate(queries), key=score)]
+            steps = [(v, q, self._useful((v, "all"))) for v, q in ordered
+                     if self._useful((v, "songs")) or self._useful((v, "all"))]
+        return steps or [(v, q, True) for v, q in queries[:1]]
 
-    for q in queries:
-        results = yt.search(q, filter="songs")
-        if not results:
-            results = yt.search(q)
+    def record(self, tried: List[Tuple[str, str]], winner: Optional[Tuple[str, str]]):
+        with self._lock:
+            for step in tried:
+                entry = self.stats.setdefault(step, [0, 0])
+                entry[0] += 1
+                if step == winner:
+                    entry[1] += 1
+            self._dirty += 1
+            if self._dirty >= 500:
+                self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO steps VALUES (?, ?, ?, ?)",
+            [(v, f, tries, wins) for (v, f), (tries, wins) in self.stats.items()],
+        )
+        self._dirty = 0
+
+_planner = QueryPlanner(QUERY_STATS_DB)
+
+_query_pool = ThreadPoolExecutor(max_workers=SEARCH_WORKERS * 4, thread_name_prefix="query")
+
+def _search_with_fallback(query: str, fallback: bool = True) -> Tuple[List[dict], List[str], bool]:
+    """
+    Results of the songs search, else of the unfiltered one; plus the filters tried
+    and whether every search tried was answered (False for NOT_CACHED ones).
+    """
+    results = cached_search(query, filter="songs")
+    if results or not fallback:
+        return results, ["songs"], results is not NOT_CACHED
+    fallback_results = cached_search(query)
+    answered = results is not NOT_CACHED and fallback_results is not NOT_CACHED
+    return fallback_results, ["songs", "all"], answered
+
+class CandidateScan:
+    """
+    Running best over one track's candidates, fed one search response at a time
+    in the order they were fetched. The running best is compared by its adjusted
+    score (combined plus _preference), which only grows, so each distinct videoId
+    is scored once: a repeat lost to the best once and cannot win later.
+    """
+
+    def __init__(self, features: TrackFeatures):
+        self.features = features
+        self.best: Optional[dict] = None
+        # store as (title_score, artist_score, combined)
+        self.best_scores = (0.0, 0.0, 0.0)
+        self.best_adjusted = 0.0  # best_scores[2] plus the best's _preference
+        self.best_step: Optional[Tuple[str, str]] = None
+        self.seen = set()  # videoIds already considered for this track
+        self.considered: List[dict] = []  # {"call", "variant", "filter", "candidate"} in fetch order
+
+    def consider(self, results: List[dict], step: Tuple[str, str], call: int) -> bool:
+        """Scores new candidates of one response; True once one is good enough to stop searching."""
+        features = self.features
+        # Wrong-length candidates (live cuts, extended mixes, ...) are dropped unscored.
+        window = []
         for r in results[:SEARCH_RESULT_LIMIT_PER_QUERY]:
-            ts, as_, comb = score_candidate(track, r)
-            # Small preference for songs
-            comb_adj = comb + (0.5 if r.get("resultType") == "song" else 0.0)
-            if comb_adj > best_scores[2] + 0.001:  # minor guard
-                best = r
-                best_scores = (ts, as_, comb)
-            if ts >= 95 and as_ >= 85:
-                return best, best_scores
-    return best, best_scores
+            vid = r.get("videoId")
+            if vid and vid in self.seen:
+                continue
+            if vid:
+                self.seen.add(vid)
+            self.considered.append({"call": call, "variant": step[0], "filter": step[1], "candidate": r})
+            if duration_fit(features, r) is not None:
+                window.append(r)
+        # One response is at most SEARCH_RESULT_LIMIT_PER_QUERY candidates, too few for
+        # score_pairs' numpy/cpdist setup to pay off; the scalar scorer is faster here.
+        with _metrics.timed("scoring"):
+            scores = [score_features(features, r) for r in window]
+        for r, (ts, as_, comb) in zip(window, scores):
+            # Small preference for songs and for the right length
+            comb_adj = comb + _preference(features, r)
+            if comb_adj > self.best_adjusted + 0.001:  # minor guard
+                self.best = r
+                self.best_scores = (ts, as_, comb)
+                self.best_adjusted = comb_adj
+                self.best_step = step
+        # Stop conditions are checked against the best of the whole response, so a
+        # weaker candidate early in it cannot end the search ahead of a better one.
+        if self.best is None:
+            return False
+        ts, as_, _ = self.best_scores
+        if ts >= 95 and as_ >= 85:
+            return True
+        # Same length and above the accept thresholds: no need for more variants.
+        return bool(duration_fit(features, self.best)) and is_accepted(self.best_scores)
+
+def search_and_match(track: dict, trace: Optional[List[dict]] = None):
+    """
+    Best candidate and its scores for a track, and whether every search was answered
+    (False when CACHE_ONLY left some unknown; the outcome then teaches the planner
+    nothing). When `trace` is given, every distinct candidate considered is appended
+    to it (see CandidateScan.considered).
+    """
+    with _metrics.timed("query_build"):
+        plan = _planner.plan(build_query_plan(track))
+    scan = CandidateScan(track_features(track))
+    tried: List[Tuple[str, str]] = []
+
+    futures: List[Future] = []
+    if SPECULATIVE_QUERIES and len(plan) > 1:
+        # All variants are in flight at once, but responses are consumed in query
+        # order, so the chosen match is the same as with sequential searching.
+        futures = [_query_pool.submit(_search_with_fallback, q, fb) for _, q, fb in plan]
+        responses = (f.result() for f in futures)
+    else:
+        responses = (_search_with_fallback(q, fb) for _, q, fb in plan)
+
+    answered = True
+    try:
+        for (variant, _, _), (results, filters, complete) in zip(plan, responses):
+            answered = answered and complete
+            tried.extend((variant, f) for f in filters)
+            if scan.consider(results, (variant, filters[-1]), len(tried)):
+                break
+    finally:
+        # Early accept (or an error): drop the variants that have not started yet.
+        # Ones already running finish in the background and land in the search cache.
+        for f in futures:
+            f.cancel()
+    best, best_scores = scan.best, scan.best_scores
+    if answered:
+        _planner.record(tried, scan.best_step if best is not None and is_accepted(best_scores) else None)
+    if trace is not None:
+        trace.extend(scan.considered)
+    return best, best_scores, answered
+
+def rescan(track: dict, considered: List[dict]):
+    """
+    Replays stored candidates through CandidateScan with the current thresholds,
+    as a live run would see them (minus anything an earlier stop never fetched).
+    """
+    scan = CandidateScan(track_features(track))
+    by_call: Dict[int, List[dict]] = {}
+    for c in considered:
+        by_call.setdefault(c["call"], []).append(c)
+    for call in sorted(by_call):
+        group = by_call[call]
+        if scan.consider([c["candidate"] for c in group], (group[0]["variant"], group[0]["filter"]), call):
+            break
+    return scan.best, scan.best_scores
+
+class CandidateStore:
+    """
+    The first CANDIDATES_KEPT distinct raw candidates seen for each track (and the
+    track itself), so results can be re-scored offline when thresholds change.
+    `mode` is "search" for candidates from search_and_match and "album" for a
+    tracklist matched by album batching.
+    """
+
+    def __init__(self, path: Path):
+        self._lock = threading.Lock()
+        self._conn = _open_state_db(
+            path,
+            "CREATE TABLE IF NOT EXISTS candidates ("
+            " track_key TEXT PRIMARY KEY, track TEXT NOT NULL, mode TEXT NOT NULL,"
+            " considered TEXT NOT NULL, stored_at REAL NOT NULL)"
+        )
+
+    def record(self, key: str, track: dict, mode: str, considered: List[dict]):
+        if mode == "search":
+            considered = considered[:CANDIDATES_KEPT]
+        slim = [dict(c, candidate=_slim(c["candidate"])) for c in considered]
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO candidates VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(track), mode, json.dumps(slim), time.time()))
+
+    def get(self, key: str) -> Optional[Tuple[dict, str, List[dict]]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT track, mode, considered FROM candidates WHERE track_key = ?", (key,)).fetchone()
+        return (json.loads(row[0]), row[1], json.loads(row[2])) if row else None
+
+    def all(self) -> Iterator[Tuple[str, dict, str, List[dict]]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT track_key, track, mode, considered FROM candidates").fetchall()
+        for key, track, mode, considered in rows:
+            yield key, json.loads(track), mode, json.loads(considered)
+
+_candidates = CandidateStore(CANDIDATES_DB)
+
+class RunJournal:
+    """
+    Write-ahead record of a run: every match result, created playlist and batch of
+    added videos is committed as it happens. If a run dies, the next one reopens the
+    unfinished run and skips whatever the journal already holds.
+    """
+
+    def __init__(self, path: Path):
+        self.run_id: Optional[int] = None
+        self._lock = threading.Lock()
+        # playlist_id -> videoId -> adds made before the restart, taken once in begin()
+        self._resumed_adds: Dict[str, Counter] = {}
+        self._conn = _open_state_db(
+            path,
+            "CREATE TABLE IF NOT EXISTS runs ("
+            " id INTEGER PRIMARY KEY, started_at REAL NOT NULL, finished_at REAL);"
+            "CREATE TABLE IF NOT EXISTS matches ("
+            " run_id INTEGER, track_key TEXT, match TEXT, title_score REAL,"
+            " artist_score REAL, combined_score REAL, PRIMARY KEY (run_id, track_key));"
+            "CREATE TABLE IF NOT EXISTS playlists ("
+            " run_id INTEGER, name TEXT, playlist_id TEXT, PRIMARY KEY (run_id, name));"
+            "CREATE TABLE IF NOT EXISTS added_videos ("
+            " run_id INTEGER, playlist_id TEXT, video_id TEXT, times INTEGER NOT NULL,"
+            " PRIMARY KEY (run_id, playlist_id, video_id));"
+            "CREATE INDEX IF NOT EXISTS matches_by_track ON matches (track_key, run_id);"
+            "CREATE TABLE IF NOT EXISTS layout ("
+            " run_id INTEGER, seq INTEGER, playlist TEXT, position INTEGER, track_key TEXT,"
+            " PRIMARY KEY (run_id, seq, position));"
+            "CREATE TABLE IF NOT EXISTS tracks ("
+            " run_id INTEGER, track_key TEXT, track TEXT, PRIMARY KEY (run_id, track_key));"
+        )
+
+    def begin(self, resume: bool = True):
+        """Reopens the latest unfinished run when `resume` is set, else starts a new one."""
+        with self._lock:
+            row = self._conn.execute("SELECT id, finished_at FROM runs ORDER BY id DESC LIMIT 1").fetchone()
+            if resume and row and row[1] is None:
+                self.run_id = row[0]
+                done = self._conn.execute(
+                    "SELECT COUNT(*) FROM matches WHERE run_id = ?", (self.run_id,)).fetchone()[0]
+                print(f"Resuming interrupted run #{self.run_id} ({done} tracks already matched).")
+                for playlist_id, video_id, times in self._conn.execute(
+                        "SELECT playlist_id, video_id, times FROM added_videos WHERE run_id = ?",
+                        (self.run_id,)):
+                    self._resumed_adds.setdefault(playlist_id, Counter())[video_id] = times
+            else:
+                self.run_id = self._conn.execute(
+                    "INSERT INTO runs (started_at) VALUES (?)", (time.time(),)).lastrowid
+
+    def finish(self):
+        with self._lock:
+            self._conn.execute("UPDATE runs SET finished_at = ? WHERE id = ?", (time.time(), self.run_id))
+
+    def get_match(self, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT match, title_score, artist_score, combined_score FROM matches"
+                " WHERE run_id = ? AND track_key = ?", (self.run_id, key)).fetchone()
+        if row is None:
+            return None
+        return (json.loads(row[0]) if row[0] else None), (row[1], row[2], row[3])
+
+    def record_match(self, key: str, match: Optional[dict], scores: Tuple[float, float, float]):
+        slim = _slim(match) if match else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?, ?)",
+                (self.run_id, key, json.dumps(slim) if slim else None, *scores))
+
+    def journaled_videos(self, key: str) -> set:
+        """videoIds a track has been matched to (accepted or not), over all runs."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT match FROM matches WHERE track_key = ? AND match IS NOT NULL", (key,)).fetchall()
+        return {v for v in (json.loads(r[0]).get("videoId") for r in rows) if v}
+
+    def record_layout(self, seq: int, name: str, tracks: List[dict]):
+        """Which tracks playlist number `seq` of this run holds, for offline re-scoring."""
+        keys = [track_key(t) for t in tracks]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO layout VALUES (?, ?, ?, ?, ?)",
+                [(self.run_id, seq, name, i, k) for i, k in enumerate(keys)])
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO tracks VALUES (?, ?, ?)",
+                [(self.run_id, k, json.dumps(t)) for k, t in zip(keys, tracks)])
+            self._conn.execute("COMMIT")
+
+    def latest_layout(self) -> Tuple[Optional[int], List[Tuple[str, List[Tuple[str, dict]]]]]:
+        """
+        The most recent run that recorded playlists, and its playlists as
+        (name, [(track_key, track)]) in run order.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(run_id) FROM layout").fetchone()
+            if row[0] is None:
+                return None, []
+            rows = self._conn.execute(
+                "SELECT l.seq, l.playlist, l.track_key, t.track FROM layout l"
+                " JOIN tracks t ON t.run_id = l.run_id AND t.track_key = l.track_key"
+                " WHERE l.run_id = ? ORDER BY l.seq, l.position", (row[0],)).fetchall()
+        playlists: List[Tuple[str, List[Tuple[str, dict]]]] = []
+        last_seq = None
+        for seq, name, key, track in rows:
+            if seq != last_seq:
+                playlists.append((name, []))
+                last_seq = seq
+            playlists[-1][1].append((key, json.loads(track)))
+        return row[0], playlists
+
+    def get_playlist(self, name: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT playlist_id FROM playlists WHERE run_id = ? AND name = ?",
+                (self.run_id, name)).fetchone()
+        return row[0] if row else None
+
+    def record_playlist(self, name: str, playlist_id: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO playlists VALUES (?, ?, ?)",
+                               (self.run_id, name, playlist_id))
+
+    def resumed_adds(self, playlist_id: str) -> Counter:
+        """
+        videoId -> times the interrupted run this one resumes added it to the playlist.
+        Empty unless resumed; every sink of the playlist shares the one Counter, so
+        each earlier add is skipped once however many source playlists feed it.
+        """
+        with self._lock:
+            return self._resumed_adds.setdefault(playlist_id, Counter())
+
+    def record_added(self, playlist_id: str, video_ids: List[str]):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT INTO added_videos VALUES (?, ?, ?, ?) ON CONFLICT (run_id, playlist_id, video_id)"
+                " DO UPDATE SET times = times + excluded.times",
+                [(self.run_id, playlist_id, vid, n) for vid, n in Counter(video_ids).items()])
+            self._conn.execute("COMMIT")
+
+_journal = RunJournal(JOURNAL_DB)
+
+# Run-wide match results keyed by track_key(), so a song that sits in many
+# playlists is searched once and the result reused for every membership.
+# Values are futures so concurrent lookups of the same track share one search.
+_resolved_tracks: Dict[str, Future] = {}
+_resolved_lock = threading.Lock()
+_match_pool = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="match")
+# Set when the run is interrupted; no playlist is written to after that.
+_stop = threading.Event()
+
+def track_identity(track: dict) -> str:
+    """Normalized title/artist plus the duration in seconds; stable across library exports."""
+    title = normalize_title(track.get("Name") or "").lower()
+    artist = normalize_title(track.get("Artist") or "").lower()
+    seconds = round((track.get("Total Time") or 0) / 1000)
+    return "meta:" + "\x1f".join((re.sub(r'\s+', ' ', title), re.sub(r'\s+', ' ', artist), str(seconds)))
+
+def track_key(track: dict) -> str:
+    """
+    Identity of a source track across playlists and files: the iTunes Persistent ID
+    when present, otherwise track_identity().
+    """
+    pid = track.get("Persistent ID")
+    if pid:
+        return f"pid:{pid}"
+    return track_identity(track)
+
+def resolve_track_async(track: dict) -> Future:
+    """Schedules search_and_match on the match pool, at most once per unique track."""
+    key = track_key(track)
+    with _resolved_lock:
+        fut = _resolved_tracks.get(key)
+        if fut is None:
+            fut = _match_pool.submit(_match_journaled, key, track)
+            _resolved_tracks[key] = fut
+    return fut
+
+def _match_journaled(key: str, track: dict):
+    journaled = _journal.get_match(key)
+    _metrics.count("cache_lookups", cache="journal", result="hit" if journaled is not None else "miss")
+    if journaled is not None:
+        return journaled
+    identity = track_identity(track)
+    known_miss = None if RETRY_UNRESOLVED else _unresolved.get(identity)
+    if not RETRY_UNRESOLVED:
+        _metrics.count("cache_lookups", cache="unresolved", result="hit" if known_miss is not None else "miss")
+    if known_miss is not None:
+        m, scores = known_miss
+    else:
+        trace: List[dict] = []
+        m, scores, answered = search_and_match(track, trace)
+        if not answered:
+            # CACHE_ONLY short-circuited a search: the outcome is not a real result,
+            # so it must not be remembered as a miss, stored or journaled.
+            return m, scores
+        _candidates.record(key, track, "search", trace)
+        if m is not None and is_accepted(scores):
+            _unresolved.forget(identity)
+        else:
+            _unresolved.record(identity, m, scores)
+    _journal.record_match(key, m, scores)
+    return m, scores
+
+def cached_get_album(browse_id: str) -> Optional[dict]:
+    """yt.get_album through the search cache, under its own key namespace."""
+    key = f"album\x1f{browse_id}"
+    cached = _search_cache.get(key)
+    _metrics.count("cache_lookups", cache="album", result="hit" if cached is not None else "miss")
+    if cached is not None:
+        return cached[0] if cached else None
+    if CACHE_ONLY:
+        return None
+    with _metrics.timed("get_album"):
+        album = _read_limiter.call(yt.get_album, browse_id)
+    _search_cache.put(key, [album] if album else [])
+    return album
+
+def match_album_tracks(album: str, album_artist: str, tracks: List[dict]):
+    """
+    Finds `album` once and matches every track against its tracklist with the
+    regular scorer. Returns the tracklist and one (match, scores) per track, or
+    None for the whole group when no album result is accepted.
+    """
+    results = [r for r in cached_search(f"{album} {album_artist}", filter="albums")
+               if r.get("browseId")][:SEARCH_RESULT_LIMIT_PER_QUERY]
+    if not results:
+        return None
+    wanted = track_features({"Name": album, "Artist": album_artist})
+    scores = score_pairs([wanted] * len(results), results).tolist()
+    best = max(range(len(results)), key=lambda i: scores[i][2])
+    if not is_accepted(tuple(scores[best])):
+        return None
+    full = cached_get_album(results[best]["browseId"])
+    tracklist = [dict(t, resultType="song") for t in (full or {}).get("tracks") or []
+                 if t.get("videoId") and t.get("isAvailable", True)]
+    if not tracklist:
+        return None
+    features = [track_features(t) for t in tracks]
+    return tracklist, best_candidates_batch(features, [tracklist] * len(tracks))
+
+def _resolve_album_group(album: str, album_artist: str, members: List[Tuple[str, dict, Future]]):
+    """
+    Match-pool job for one album group. Accepted album matches complete the
+    members' futures directly; the rest are handed to the per-track path.
+    """
+    try:
+        _resolve_album_members(album, album_artist, members)
+    except Exception as e:
+        # Nobody else will complete these futures; fail them instead of hanging the writer.
+        for _, _, fut in members:
+            if not fut.done():
+                fut.set_exception(e)
+
+def _resolve_album_members(album: str, album_artist: str, members: List[Tuple[str, dict, Future]]):
+    pending = []
+    for key, track, fut in members:
+        journaled = _journal.get_match(key)
+        _metrics.count("cache_lookups", cache="journal", result="hit" if journaled is not None else "miss")
+        if journaled is not None:
+            fut.set_result(journaled)
+        else:
+            pending.append((key, track, fut))
+    tracklist, matches = [], None
+    if len(pending) >= ALBUM_MIN_TRACKS:
+        try:
+            tracklist, matches = match_album_tracks(album, album_artist, [t for _, t, _ in pending]) or ([], None)
+        except Exception as e:
+            print(f"[ALBUM] Lookup failed for '{album}', searching tracks individually: {e}")
+    for i, (key, track, fut) in enumerate(pending):
+        if matches is not None and matches[i][0] is not None and is_accepted(matches[i][1]):
+            _candidates.record(key, track, "album",
+                               [{"call": ALBUM_LOOKUP_CALLS, "variant": "album", "filter": "albums", "candidate": c}
+                                for c in tracklist])
+            _journal.record_match(key, *matches[i])
+            fut.set_result(matches[i])
+        else:
+            _chain(_match_pool.submit(_match_journaled, key, track), fut)
+
+def _chain(source: Future, target: Future):
+    def copy(done: Future):
+        if done.cancelled():
+            target.cancel()
+        elif done.exception() is not None:
+            target.set_exception(done.exception())
+        else:
+            target.set_result(done.result())
+    source.add_done_callback(copy)
+
+def submit_playlist(tracks: List[dict]) -> List[Future]:
+    """
+    Schedules matching for every track of a playlist and returns a future per
+    track, in order. With ALBUM_BATCHING, tracks not yet known to the run that
+    share an (Album, Album Artist) with at least ALBUM_MIN_TRACKS - 1 others are
+    resolved together through one album lookup.
+    """
+    if ALBUM_BATCHING:
+        groups: Dict[Tuple[str, str], List[Tuple[str, dict]]] = {}
+        for t in tracks:
+            album = (t.get("Album") or "").strip()
+            album_artist = (t.get("Album Artist") or t.get("Artist") or "").strip()
+            if album and album_artist:
+                groups.setdefault((album, album_artist), []).append((track_key(t), t))
+        for (album, album_artist), group in groups.items():
+            members = []
+            with _resolved_lock:
+                for key, t in group:
+                    if key not in _resolved_tracks:
+                        _resolved_tracks[key] = fut = Future()
+                        members.append((key, t, fut))
+            if len(members) >= ALBUM_MIN_TRACKS:
+                _match_pool.submit(_resolve_album_group, album, album_artist, members)
+            else:
+                for key, t, fut in members:
+                    _chain(_match_pool.submit(_match_journaled, key, t), fut)
+    return [resolve_track_async(t) for t in tracks]
 
 def is_accepted(scores: Tuple[float, float, float]) -> bool:
     ts, as_, comb = scores
     return (ts >= ACCEPT_TITLE_MIN and as_ >= ACCEPT_ARTIST_MIN) or comb >= ACCEPT_COMBINED_MIN
 
+# Library playlists by title, listed once per run (all pages) and kept current
+# as playlists are created, so lookups need no further requests.
+_playlist_index: Optional[Dict[str, str]] = None
+_playlist_index_lock = threading.Lock()
+
+def library_playlist_index() -> Dict[str, str]:
+    global _playlist_index
+    with _playlist_index_lock:
+        if _playlist_index is None:
+            index: Dict[str, str] = {}
+            for pl in _read_limiter.call(yt.get_library_playlists, limit=None):
+                if pl.get("title") and pl.get("playlistId"):
+                    index.setdefault(pl["title"], pl["playlistId"])
+            _playlist_index = index
+        return _playlist_index
+
 def find_or_create_playlist(name: str, description="Imported from Apple Music") -> str:
-    existing = yt.get_library_playlists(limit=100)
-    for pl in existing:
-        if pl.get("title") == name:
-            return pl["playlistId"]
+    with _metrics.timed("playlist_lookup"):
+        return _find_or_create_playlist(name, description)
+
+def _find_or_create_playlist(name: str, description: str) -> str:
+    journaled = _journal.get_playlist(name)
+    if journaled:
+        return journaled
+    index = library_playlist_index()
+    if name in index:
+        return index[name]
     if DRY_RUN:
         return "DRY_RUN_PLAYLIST_ID"
-    return yt.create_playlist(name, description, privacy_status="PRIVATE")
+    with _metrics.timed("playlist_create"):
+        playlist_id = _write_limiter.call(yt.create_playlist, name, description, privacy_status="PRIVATE")
+    _journal.record_playlist(name, playlist_id)
+    with _playlist_index_lock:
+        index[name] = playlist_id
+    return playlist_id
 
 @dataclass
 class MatchRecord:
@@ -153,55 +1428,191 @@ class MatchRecord:
     artist_score: float
     combined_score: float
     video_id: str
-    status: str  # MATCH / REVIEW / NO_RESULT
+    status: str  # MATCH / REVIEW / NO_RESULT / ERROR
 
-def process_playlist(playlist_name: str, tracks: List[dict]) -> List[MatchRecord]:
+def _unmatched_record(t: dict, status: str) -> MatchRecord:
+    return MatchRecord(
+        original_title=t.get("Name",""),
+        original_artist=t.get("Artist",""),
+        matched_title="",
+        matched_artists="",
+        title_score=0,
+        artist_score=0,
+        combined_score=0,
+        video_id="",
+        status=status
+    )
+
+def collect_playlist(playlist_name: str, tracks: List[dict], futures: List[Future],
+                     sink: Optional["PlaylistSink"] = None) -> List[MatchRecord]:
+    """
+    Turns the match futures of a playlist into MatchRecords. The tracks are already
+    submitted; collecting in playlist order keeps the output and report deterministic
+    whatever order the searches finish in. Each record is passed on to `sink` as
+    soon as it is known.
+    """
     print(f"\n=== Processing playlist: {playlist_name} ({len(tracks)} tracks) ===")
     records: List[MatchRecord] = []
-    for t in tracks:
-        m, scores = search_and_match(t)
-        ts, as_, comb = scores
-        if m:
-            vid = m.get("videoId", "")
-            artists_joined = " | ".join(a['name'] for a in m.get("artists", []) or [])
-            status = "MATCH" if is_accepted(scores) else "REVIEW"
-            label = "[MATCH]" if status == "MATCH" else "[REVIEW]"
-            print(f"{label} {t.get('Name')} -> {m.get('title')} (T:{ts:.1f} A:{as_:.1f} C:{comb:.1f})")
-            records.append(MatchRecord(
-                original_title=t.get("Name",""),
-                original_artist=t.get("Artist",""),
-                matched_title=m.get("title",""),
-                matched_artists=artists_joined,
-                title_score=ts,
-                artist_score=as_,
-                combined_score=comb,
-                video_id=vid,
-                status=status
-            ))
-        else:
-            print(f"[NO RESULT] {t.get('Name')}")
-            records.append(MatchRecord(
-                original_title=t.get("Name",""),
-                original_artist=t.get("Artist",""),
-                matched_title="",
-                matched_artists="",
-                title_score=0,
-                artist_score=0,
-                combined_score=0,
-                video_id="",
-                status="NO_RESULT"
-            ))
+    for t, fut in zip(tracks, futures):
+        if _stop.is_set():
+            break
+        record = _record_from_future(t, fut)
+        records.append(record)
+        if sink is not None:
+            sink.add(record, track_key(t))
     return records
 
-def add_tracks_to_yt_playlist(playlist_id: str, records: List[MatchRecord]):
-    video_ids = [r.video_id for r in records if r.status == "MATCH" and r.video_id]
-    if DRY_RUN:
-        print(f"[DRY RUN] Would add {len(video_ids)} tracks.")
-        return
-    for i in range(0, len(video_ids), ADD_CHUNK):
-        chunk = video_ids[i:i+ADD_CHUNK]
-        yt.add_playlist_items(playlist_id, chunk)
-        print(f"Added {len(chunk)} tracks (chunk {i//ADD_CHUNK + 1}).")
+def _record_from_future(t: dict, fut: Future) -> MatchRecord:
+    try:
+        m, scores = fut.result()
+    except Exception as e:
+        # Retries are exhausted at this point; keep going with the rest.
+        print(f"[ERROR] {t.get('Name')}: {e}")
+        return _unmatched_record(t, "ERROR")
+    record = make_record(t, m, scores)
+    if record.status == "NO_RESULT":
+        print(f"[NO RESULT] {t.get('Name')}")
+    else:
+        print(f"[{record.status}] {t.get('Name')} -> {record.matched_title} "
+              f"(T:{record.title_score:.1f} A:{record.artist_score:.1f} C:{record.combined_score:.1f})")
+    return record
+
+def make_record(t: dict, m: Optional[dict], scores: Tuple[float, float, float]) -> MatchRecord:
+    if not m:
+        return _unmatched_record(t, "NO_RESULT")
+    ts, as_, comb = scores
+    return MatchRecord(
+        original_title=t.get("Name",""),
+        original_artist=t.get("Artist",""),
+        matched_title=m.get("title",""),
+        matched_artists=" | ".join(a['name'] for a in m.get("artists", []) or []),
+        title_score=ts,
+        artist_score=as_,
+        combined_score=comb,
+        video_id=m.get("videoId", ""),
+        status="MATCH" if is_accepted(scores) else "REVIEW"
+    )
+
+def fetch_playlist_items(playlist_id: str) -> List[dict]:
+    """Current contents of a YT Music playlist (items without a videoId are skipped)."""
+    if playlist_id == "DRY_RUN_PLAYLIST_ID":
+        return []
+    with _metrics.timed("playlist_read"):
+        playlist = _read_limiter.call(yt.get_playlist, playlist_id, limit=None)
+    return [t for t in playlist.get("tracks") or [] if t.get("videoId")]
+
+class PlaylistSink:
+    """
+    Streaming writer for one target playlist. Accepted matches are fed in playlist
+    order through add() and flushed to YT Music every ADD_CHUNK tracks, so adds run
+    while the rest of the playlist is still matching; close() flushes the remainder
+    and, with REMOVE_MISSING, removes items whose source track is gone. Source
+    tracks that did not MATCH this run keep every video they were ever journaled
+    with; if one whose outcome is uncertain (ERROR, or NO_RESULT under CACHE_ONLY)
+    has none, nothing is removed from the playlist.
+    """
+
+    def __init__(self, playlist_id: str):
+        self.playlist_id = playlist_id
+        self.ok = True
+        self._buffer: List[str] = []
+        self._pos = 0           # stream offset of the first buffered id
+        self._wanted = set()
+        self._existing: List[dict] = []
+        self._present = set()
+        self._added = 0
+        if SYNC_EXISTING:
+            try:
+                self._existing = fetch_playlist_items(playlist_id)
+            except Exception as e:
+                # Appending blind here could duplicate the whole playlist.
+                print(f"[ERROR] Could not read playlist contents, skipping adds: {e}")
+                self.ok = False
+            self._present = {t["videoId"] for t in self._existing}
+            # The diff already leaves out whatever an interrupted run managed to add.
+            self._done = Counter()
+        else:
+            # Matched per videoId, not by position: tracks that errored before a
+            # restart may match now and shift everything after them.
+            self._done = _journal.resumed_adds(playlist_id)
+        self._skipped = 0
+        self._unknown = 0  # uncertain source tracks without any known video
+
+    def add(self, record: MatchRecord, key: Optional[str] = None):
+        if not self.ok or _stop.is_set():
+            return
+        if record.status != "MATCH" or not record.video_id:
+            if SYNC_EXISTING and REMOVE_MISSING:
+                # Still in the source: whatever it was matched to before must stay.
+                kept = _journal.journaled_videos(key) if key else set()
+                if record.video_id:
+                    kept.add(record.video_id)
+                self._wanted.update(kept)
+                uncertain = record.status == "ERROR" or (record.status == "NO_RESULT" and CACHE_ONLY)
+                self._unknown += uncertain and not kept
+            return
+        vid = record.video_id
+        if SYNC_EXISTING:
+            if vid in self._present or vid in self._wanted:
+                self._wanted.add(vid)
+                return
+        self._wanted.add(vid)
+        if self._done[vid] > 0:
+            # Added by the interrupted run this one resumes.
+            self._done[vid] -= 1
+            self._skipped += 1
+            return
+        self._buffer.append(vid)
+        if len(self._buffer) >= ADD_CHUNK:
+            self._flush()
+
+    def _flush(self):
+        chunk, start = self._buffer, self._pos
+        self._buffer, self._pos = [], self._pos + len(chunk)
+        if not chunk or _stop.is_set():
+            return
+        n = start // ADD_CHUNK + 1
+        if DRY_RUN:
+            self._added += len(chunk)
+            return
+        try:
+            with _metrics.timed("playlist_add"):
+                _write_limiter.call(yt.add_playlist_items, self.playlist_id, chunk)
+        except Exception as e:
+            print(f"[ERROR] Failed to add chunk {n} ({len(chunk)} tracks): {e}")
+            return
+        if not SYNC_EXISTING:
+            _journal.record_added(self.playlist_id, chunk)
+        self._added += len(chunk)
+        print(f"Added {len(chunk)} tracks (chunk {n}).")
+
+    def close(self):
+        if not self.ok or _stop.is_set():
+            return
+        self._flush()
+        if self._skipped:
+            print(f"Skipped {self._skipped} tracks added before restart.")
+        to_remove = []
+        if SYNC_EXISTING and REMOVE_MISSING and self._unknown:
+            print(f"Not removing anything: {self._unknown} source tracks could not be matched "
+                  f"this run and have no known video to keep.")
+        elif SYNC_EXISTING and REMOVE_MISSING:
+            to_remove = [t for t in self._existing if t["videoId"] not in self._wanted and t.get("setVideoId")]
+        if SYNC_EXISTING:
+            print(f"Sync: {len(self._present)} already in playlist, {self._added} added, "
+                  f"{len(to_remove)} to remove.")
+        if DRY_RUN:
+            print(f"[DRY RUN] Would add {self._added} tracks and remove {len(to_remove)}.")
+            return
+        for i in range(0, len(to_remove), ADD_CHUNK):
+            chunk = [{"videoId": t["videoId"], "setVideoId": t["setVideoId"]} for t in to_remove[i:i+ADD_CHUNK]]
+            try:
+                with _metrics.timed("playlist_remove"):
+                    _write_limiter.call(yt.remove_playlist_items, self.playlist_id, chunk)
+            except Exception as e:
+                print(f"[ERROR] Failed to remove {len(chunk)} tracks: {e}")
+                continue
+            print(f"Removed {len(chunk)} tracks no longer in the source playlist.")
 
 def write_playlist_report(playlist_name: str, records: List[MatchRecord]):
     safe_name = re.sub(r'[^A-Za-z0-9._-]+','_', playlist_name).strip('_') or "playlist"
@@ -218,6 +1629,72 @@ def write_playlist_report(playlist_name: str, records: List[MatchRecord]):
             ])
     print(f"Report written: {report_file}")
 
+def write_master_summary(all_records_master: List[Tuple[str, MatchRecord]]):
+    master_file = OUTPUT_DIR / "all_playlists_summary.csv"
+    with open(master_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Playlist","Original Title","Original Artist","Matched Title",
+                         "Matched Artist(s)","TitleScore","ArtistScore","CombinedScore","VideoId","Status"])
+        for pl_name, r in all_records_master:
+            writer.writerow([
+                pl_name, r.original_title, r.original_artist, r.matched_title,
+                r.matched_artists, f"{r.title_score:.1f}", f"{r.artist_score:.1f}",
+                f"{r.combined_score:.1f}", r.video_id, r.status
+            ])
+    print(f"\nMaster summary: {master_file}")
+
+def write_run_summary():
+    """Writes RUN_SUMMARY_JSON and RUN_SUMMARY_PROM and prints where the time went."""
+    for cache, fn in (("candidate_title", _candidate_title_norm), ("candidate_artist", _candidate_artist_norm)):
+        info = fn.cache_info()
+        _metrics.count("cache_lookups", info.hits, cache=cache, result="hit")
+        _metrics.count("cache_lookups", info.misses, cache=cache, result="miss")
+    summary = _metrics.summary()
+    RUN_SUMMARY_JSON.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    # Written aside and renamed, so a textfile collector never reads half a file.
+    tmp = RUN_SUMMARY_PROM.with_suffix(".prom.tmp")
+    tmp.write_text(_metrics.prometheus(), encoding="utf-8")
+    os.replace(tmp, RUN_SUMMARY_PROM)
+
+    print(f"\nStage timings ({summary['wall_seconds']:.1f}s wall; stages overlap across threads):")
+    for name, st in summary["stages"].items():
+        print(f"  {name:<16} {st['count']:>7} calls {st['total_seconds']:>10.1f}s total "
+              f"p50 {st['p50_seconds']:.3f}s p95 {st['p95_seconds']:.3f}s"
+              + (f" {st['errors']} errors" if st["errors"] else ""))
+    if summary["cache_hit_rates"]:
+        print("  cache hit rates: " + ", ".join(f"{c} {r:.0%}" for c, r in summary["cache_hit_rates"].items()))
+    print(f"Run summary: {RUN_SUMMARY_JSON}, {RUN_SUMMARY_PROM}")
+
+def _playlist_writer(pending: "queue.Queue", all_records_master: List[Tuple[str, MatchRecord]]):
+    """
+    Write stage of the pipeline: finds/creates each queued playlist, streams its
+    matches into it as they arrive, then reports it while later playlists keep matching.
+    A None entry, or the run being interrupted, ends the stage.
+    """
+    while True:
+        entry = pending.get()
+        if entry is None or _stop.is_set():
+            return
+        pl_name, tracks, futures = entry
+        try:
+            # The target is resolved first so adds can stream while matches arrive.
+            sink = None
+            try:
+                sink = PlaylistSink(find_or_create_playlist(pl_name))
+            except Exception as e:
+                print(f"[ERROR] Could not find or create playlist '{pl_name}': {e}")
+            records = collect_playlist(pl_name, tracks, futures, sink)
+            if sink is not None:
+                sink.close()
+            for r in records:
+                _metrics.count("tracks", status=r.status)
+            with _metrics.timed("report_write"):
+                write_playlist_report(pl_name, records)
+            all_records_master.extend((pl_name, r) for r in records)
+        except Exception as e:
+            # Keep draining the queue, or the parse stage would block on it forever.
+            print(f"[ERROR] Playlist '{pl_name}' failed: {e}")
+
 def main():
     if not PLAYLISTS_DIR.is_dir():
         raise SystemExit(f"Folder '{PLAYLISTS_DIR}' not found.")
@@ -229,43 +1706,58 @@ def main():
         print("No XML files found in 'playlists/'")
         return
 
-    for xml_path in xml_files:
-        print(f"\n>>> Reading file: {xml_path.name}")
-        try:
-            root = load_plist(xml_path)
-        except Exception as e:
-            print(f"Failed to parse {xml_path.name}: {e}")
-            continue
+    _metrics.begin()
+    _journal.begin(resume=RESUME)
 
-        playlist_entries = extract_playlist_entries(root)
-        if not playlist_entries:
-            # fallback: use filename as playlist name if structure is unusual
-            print(f"No playlist objects found in {xml_path.name}; skipping.")
-            continue
+    # parse + submit matches (this thread) -> bounded queue -> write stage (writer thread).
+    # The queue bound is the backpressure: parsing stops PIPELINE_DEPTH playlists ahead.
+    pending: "queue.Queue" = queue.Queue(maxsize=PIPELINE_DEPTH)
+    # Daemon, so an interrupted run exits without waiting on the playlist being written.
+    writer = threading.Thread(target=_playlist_writer, args=(pending, all_records_master),
+                              name="playlist-writer", daemon=True)
+    writer.start()
+    seq = 0
+    try:
+        for xml_path in xml_files:
+            print(f"\n>>> Reading file: {xml_path.name}")
+            found = 0
+            try:
+                for entry in _metrics.timed_iter("plist_parse", iter_plist_playlists(xml_path)):
+                    found += 1
+                    tracks = entry["tracks"]
+                    _journal.record_layout(seq, entry["name"], tracks)
+                    seq += 1
+                    pending.put((entry["name"], tracks, submit_playlist(tracks)))
+            except (ET.ParseError, ValueError, OSError) as e:
+                # Malformed values (a non-numeric <integer>, ...) or an unreadable file
+                # skip this file, not the whole run.
+                print(f"Failed to parse {xml_path.name}: {e}")
+                continue
 
-        for entry in playlist_entries:
-            pl_name = entry["name"]
-            records = process_playlist(pl_name, entry["tracks"])
-            playlist_id = find_or_create_playlist(pl_name)
-            add_tracks_to_yt_playlist(playlist_id, records)
-            write_playlist_report(pl_name, records)
-            all_records_master.extend((pl_name, r) for r in records)
+            if not found:
+                print(f"No playlist objects found in {xml_path.name}; skipping.")
+        pending.put(None)
+        writer.join()
+    except BaseException:
+        # Ctrl-C or a crash: stop writing, drop queued matches and leave the journal
+        # for RESUME. Searches already running finish, but nothing is added after this.
+        _stop.set()
+        _match_pool.shutdown(wait=False, cancel_futures=True)
+        _query_pool.shutdown(wait=False, cancel_futures=True)
+        print("\nRun stopped; no further playlist changes will be made.")
+        raise
 
     # Master summary CSV (optional)
     if all_records_master:
-        master_file = OUTPUT_DIR / "all_playlists_summary.csv"
-        with open(master_file, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(["Playlist","Original Title","Original Artist","Matched Title",
-                             "Matched Artist(s)","TitleScore","ArtistScore","CombinedScore","VideoId","Status"])
-            for pl_name, r in all_records_master:
-                writer.writerow([
-                    pl_name, r.original_title, r.original_artist, r.matched_title,
-                    r.matched_artists, f"{r.title_score:.1f}", f"{r.artist_score:.1f}",
-                    f"{r.combined_score:.1f}", r.video_id, r.status
-                ])
-        print(f"\nMaster summary: {master_file}")
+        with _metrics.timed("report_write"):
+            write_master_summary(all_records_master)
 
+    _planner.save()
+    if BACKEND == "record":
+        yt.save()
+        print(f"Recorded responses: {FIXTURES_FILE}")
+    _journal.finish()
+    write_run_summary()
     print("\nDone.")
 
 if __name__ == "__main__":
@@ -0,0 +1,174 @@
+"""
+Offline stand-ins for the YTMusic client.
+
+ReplayClient serves recorded responses from a fixture file, with optional
+injected latency and error rates, so the import pipeline can be run, tested and
+benchmarked without OAuth or network access. RecordingClient wraps a real client
+and writes every response it sees to such a fixture file.
+
+Fixture format (JSON)::
+
+    {
+      "search": {"<fixture_key(query, filter)>": [result, ...]},
+      "albums": {"<browseId>": {...get_album response...}},
+      "library_playlists": [{"title": ..., "playlistId": ...}, ...],
+      "playlists": {"<playlistId>": [{"videoId": ..., "setVideoId": ...}, ...]}
+    }
+
+Select it for import_music.py with MUSIC_TRANSFER_BACKEND=replay and
+MUSIC_TRANSFER_FIXTURES=<path>.
+"""
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from unidecode import unidecode
+from ytmusicapi.exceptions import YTMusicServerError
+
+def fixture_key(query: str, filter: Optional[str] = None) -> str:
+    canon = re.sub(r'\s+', ' ', unidecode(query)).strip().lower()
+    return f"{filter or ''}\x1f{canon}"
+
+class ReplayClient:
+    """
+    Serves search, get_album, get_library_playlists and get_playlist from fixtures
+    and applies create_playlist / add_playlist_items / remove_playlist_items to an
+    in-memory copy. Unknown searches return no results.
+
+    Every call sleeps `latency` seconds (plus up to `jitter`) and fails with
+    probability `error_rate`, as HTTP 429 or 503 in the same form ytmusicapi
+    raises them. `seed` makes the injected delays and failures reproducible.
+    `calls` counts calls per method.
+    """
+
+    def __init__(self, fixtures: Optional[dict] = None, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, seed: Optional[int] = None):
+        fixtures = fixtures or {}
+        self.searches: Dict[str, List[dict]] = dict(fixtures.get("search", {}))
+        self.albums: Dict[str, dict] = dict(fixtures.get("albums", {}))
+        self.library = [dict(p) for p in fixtures.get("library_playlists", [])]
+        self.playlists: Dict[str, List[dict]] = {k: list(v) for k, v in fixtures.get("playlists", {}).items()}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls: Counter = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._next_set_id = 0  # never reused, so a removed item's setVideoId cannot come back
+
+    @classmethod
+    def from_file(cls, path, **kwargs) -> "ReplayClient":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), **kwargs)
+
+    def call_counts(self) -> Dict[str, int]:
+        """A copy of `calls` (also reachable through a multiprocessing proxy)."""
+        with self._lock:
+            return dict(self.calls)
+
+    def _call(self, method: str):
+        with self._lock:
+            self.calls[method] += 1
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            fail = self._rng.random() < self.error_rate
+            status = self._rng.choice((429, 503))
+        if delay:
+            time.sleep(delay)
+        if fail:
+            reason = "Too Many Requests" if status == 429 else "Service Unavailable"
+            raise YTMusicServerError(f"Server returned HTTP {status}: {reason}.\n(replayed error)")
+
+    def search(self, query: str, filter: Optional[str] = None, **kwargs) -> List[dict]:
+        self._call("search")
+        return [dict(r) for r in self.searches.get(fixture_key(query, filter), [])]
+
+    def get_album(self, browseId: str) -> dict:
+        self._call("get_album")
+        return dict(self.albums.get(browseId) or {"tracks": []})
+
+    def get_library_playlists(self, limit: Optional[int] = 25) -> List[dict]:
+        self._call("get_library_playlists")
+        with self._lock:
+            return [dict(p) for p in (self.library if limit is None else self.library[:limit])]
+
+    def get_playlist(self, playlistId: str, limit: Optional[int] = 100, **kwargs) -> dict:
+        self._call("get_playlist")
+        with self._lock:
+            tracks = list(self.playlists.get(playlistId, []))
+        return {"id": playlistId, "tracks": tracks if limit is None else tracks[:limit]}
+
+    def create_playlist(self, title: str, description: str, privacy_status: str = "PRIVATE", **kwargs) -> str:
+        self._call("create_playlist")
+        with self._lock:
+            self._next_id += 1
+            playlist_id = f"PLREPLAY{self._next_id:06d}"
+            self.library.append({"title": title, "playlistId": playlist_id, "count": 0})
+            self.playlists[playlist_id] = []
+        return playlist_id
+
+    def add_playlist_items(self, playlistId: str, videoIds: Optional[List[str]] = None, **kwargs) -> dict:
+        self._call("add_playlist_items")
+        with self._lock:
+            items = self.playlists.setdefault(playlistId, [])
+            for v in videoIds or []:
+                self._next_set_id += 1
+                items.append({"videoId": v, "setVideoId": f"SETREPLAY{self._next_set_id:08d}"})
+        return {"status": "STATUS_SUCCEEDED"}
+
+    def remove_playlist_items(self, playlistId: str, videos: List[dict]) -> str:
+        self._call("remove_playlist_items")
+        gone = {v.get("setVideoId") for v in videos}
+        with self._lock:
+            self.playlists[playlistId] = [t for t in self.playlists.get(playlistId, [])
+                                          if t.get("setVideoId") not in gone]
+        return "STATUS_SUCCEEDED"
+
+class RecordingClient:
+    """
+    Passes every call through to `client` and keeps the read responses in the
+    fixture format ReplayClient loads. Call save() to write them out.
+    """
+
+    def __init__(self, client, path):
+        self.client = client
+        self.path = Path(path)
+        self.fixtures = {"search": {}, "albums": {}, "library_playlists": [], "playlists": {}}
+        self._lock = threading.Lock()
+
+    def search(self, query: str, filter: Optional[str] = None, **kwargs):
+        results = self.client.search(query, filter=filter, **kwargs) if filter else self.client.search(query, **kwargs)
+        with self._lock:
+            self.fixtures["search"][fixture_key(query, filter)] = results
+        return results
+
+    def get_album(self, browseId: str):
+        album = self.client.get_album(browseId)
+        with self._lock:
+            self.fixtures["albums"][browseId] = album
+        return album
+
+    def get_library_playlists(self, limit: Optional[int] = 25):
+        playlists = self.client.get_library_playlists(limit=limit)
+        with self._lock:
+            self.fixtures["library_playlists"] = playlists
+        return playlists
+
+    def get_playlist(self, playlistId: str, limit: Optional[int] = 100, **kwargs):
+        playlist = self.client.get_playlist(playlistId, limit=limit, **kwargs)
+        with self._lock:
+            self.fixtures["playlists"][playlistId] = playlist.get("tracks") or []
+        return playlist
+
+    def __getattr__(self, name):
+        # Writes (create/add/remove) are passed through unrecorded.
+        return getattr(self.client, name)
+
+    def save(self):
+        with self._lock:
+            self.path.write_text(json.dumps(self.fixtures), encoding="utf-8")
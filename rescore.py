@@ -0,0 +1,63 @@
+"""
+Re-scores the last import run offline and rewrites its reports.
+
+Uses the raw candidates import_music.py stored in state/candidates.sqlite3, so
+accept thresholds can be changed and tried without a single API call:
+
+    python rescore.py --title-min 85 --artist-min 70 --combined-min 82
+"""
+import argparse
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import import_music as im
+
+def rescore_track(key: str, track: dict):
+    stored = im._candidates.get(key)
+    if stored is None:
+        # Reused from the journal or the known-miss cache without a stored trace:
+        # all we have is the chosen candidate, scored again with current weights.
+        journaled = im._journal.get_match(key)
+        if journaled is None or journaled[0] is None:
+            return None, (0.0, 0.0, 0.0)
+        return journaled[0], im.score_candidate(track, journaled[0])
+    _, mode, considered = stored
+    if mode == "album":
+        return im.best_candidates_batch([im.track_features(track)], [[c["candidate"] for c in considered]])[0]
+    return im.rescan(track, considered)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--title-min", type=float, default=im.ACCEPT_TITLE_MIN)
+    parser.add_argument("--artist-min", type=float, default=im.ACCEPT_ARTIST_MIN)
+    parser.add_argument("--combined-min", type=float, default=im.ACCEPT_COMBINED_MIN)
+    args = parser.parse_args()
+    im.ACCEPT_TITLE_MIN = args.title_min
+    im.ACCEPT_ARTIST_MIN = args.artist_min
+    im.ACCEPT_COMBINED_MIN = args.combined_min
+
+    run_id, playlists = im._journal.latest_layout()
+    if run_id is None:
+        raise SystemExit("No recorded run in state/journal.sqlite3; run import_music.py first.")
+    im._journal.run_id = run_id
+
+    results: Dict[str, Tuple] = {}
+    all_records_master: List[Tuple[str, im.MatchRecord]] = []
+    for pl_name, members in playlists:
+        records = []
+        for key, track in members:
+            if key not in results:
+                results[key] = rescore_track(key, track)
+            records.append(im.make_record(track, *results[key]))
+        im.write_playlist_report(pl_name, records)
+        all_records_master.extend((pl_name, r) for r in records)
+    if all_records_master:
+        im.write_master_summary(all_records_master)
+
+    counts = Counter(r.status for _, r in all_records_master)
+    print(f"\nRe-scored {len(results)} tracks of run #{run_id} "
+          f"(T>={args.title_min:g} A>={args.artist_min:g} C>={args.combined_min:g}): "
+          + ", ".join(f"{status} {n}" for status, n in sorted(counts.items())))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Sweeps accept thresholds and the title/artist weight over a labeled golden set.
+
+The golden set is a report CSV from import_music.py (a per-playlist report or
+all_playlists_summary.csv) whose Status column has been corrected by hand: a row
+marked MATCH means its VideoId is the right video (fix the VideoId if needed),
+any other status means the track should not be auto-accepted. Candidates come
+from state/candidates.sqlite3, so the sweep makes no API calls:
+
+    python tune_thresholds.py reports/golden.csv --top 15
+
+For every configuration it reports precision/recall of the accepted matches
+and the searches a live run would spend, estimated from the API call at which
+each track's search would stop under that configuration. Each track's pick is
+its best candidate over everything stored; a live run that stops earlier may
+settle on a different one, so treat the numbers as estimates. Tracks matched by
+album batching have no early stop and share one album lookup per album, so
+they are scored like the rest but cost a fixed ALBUM_LOOKUP_CALLS per album.
+"""
+import argparse
+import csv
+import itertools
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import import_music as im
+
+def load_golden(path: Path) -> Dict[Tuple[str, str], str]:
+    """(Original Title, Original Artist) -> correct videoId, or "" when nothing should be accepted."""
+    golden = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            key = (row["Original Title"], row["Original Artist"])
+            golden[key] = row["VideoId"] if row["Status"].strip().upper() == "MATCH" else ""
+    return golden
+
+def candidate_matrices(golden: Dict[Tuple[str, str], str]):
+    """
+    Raw per-candidate arrays for every labeled track with stored candidates, padded
+    to the longest candidate list: title/artist scores, tie-break preference, the
+    API call a candidate arrived with, whether it has the right length, whether it
+    is the labeled video, and a validity mask. Also returns per-track call totals
+    and whether the track has a correct answer at all, plus the fixed cost of the
+    album lookups behind album-batched tracks (whose own calls are zeroed).
+    """
+    tracks, lists = [], []
+    albums = set()
+    for _, track, mode, considered in im._candidates.all():
+        label = golden.get((track.get("Name", ""), track.get("Artist", "")))
+        if label is None:
+            continue
+        features = im.track_features(track)
+        kept = [c for c in considered if im.duration_fit(features, c["candidate"]) is not None]
+        if mode == "album":
+            # One lookup serves the whole group and there is no early stop to model.
+            albums.add((track.get("Album", ""), track.get("Album Artist") or track.get("Artist", "")))
+            kept = [dict(c, call=0) for c in kept]
+            tracks.append((features, label, 0))
+        else:
+            tracks.append((features, label, max((c["call"] for c in considered), default=0)))
+        lists.append(kept)
+    n = len(tracks)
+    k = max((len(c) for c in lists), default=0)
+    shape = (n, max(k, 1))
+    title, artist = np.full(shape, -1.0), np.full(shape, -1.0)
+    pref, calls = np.zeros(shape), np.zeros(shape)
+    fits, correct, valid = (np.zeros(shape, dtype=bool) for _ in range(3))
+
+    rows = np.repeat(np.arange(n), [len(c) for c in lists])
+    cols = np.concatenate([np.arange(len(c)) for c in lists]) if n else np.zeros(0, dtype=int)
+    flat = [c for cands in lists for c in cands]
+    owners = [tracks[i][0] for i in rows]
+    scores = im.score_pairs(owners, [c["candidate"] for c in flat], workers=-1)
+    title[rows, cols] = scores[:, 0]
+    artist[rows, cols] = scores[:, 1]
+    valid[rows, cols] = True
+    pref[rows, cols] = [im._preference(f, c["candidate"]) for f, c in zip(owners, flat)]
+    calls[rows, cols] = [c["call"] for c in flat]
+    fits[rows, cols] = [bool(im.duration_fit(f, c["candidate"])) for f, c in zip(owners, flat)]
+    correct[rows, cols] = [bool(tracks[i][1]) and c["candidate"].get("videoId") == tracks[i][1]
+                           for i, c in zip(rows, flat)]
+    total_calls = np.array([t[2] for t in tracks], dtype=float)
+    has_answer = np.array([bool(t[1]) for t in tracks])
+    album_calls = float(len(albums) * im.ALBUM_LOOKUP_CALLS)
+    return title, artist, pref, calls, fits, correct, valid, total_calls, has_answer, album_calls
+
+def sweep(m, weights, title_mins, artist_mins, combined_mins) -> List[dict]:
+    title, artist, pref, calls, fits, correct, valid, total_calls, has_answer, album_calls = m
+    n = title.shape[0]
+    rows = np.arange(n)
+    c_grid = np.asarray(combined_mins, dtype=float)
+    k = title.shape[1]
+    vf = valid & fits
+    early = valid & (title >= 95) & (artist >= 85)
+
+    def first(mask):
+        """Index of the first True per row (along the last axis), k when there is none."""
+        return np.where(mask.any(axis=-1), mask.argmax(axis=-1), k)
+
+    out = []
+    for w in weights:
+        comb = w * title + (1 - w) * artist
+        pick = np.argmax(np.where(valid, comb + pref, -np.inf), axis=1)
+        bt, ba, bc = title[rows, pick], artist[rows, pick], comb[rows, pick]
+        picked_right = correct[rows, pick]
+        # A track stops at its first candidate that is an early accept, or has the right
+        # length and passes the thresholds. The combined-threshold part does not depend
+        # on T/A, so its first hit is found once per weight for every C: (len(c_grid), n)
+        stop_by_comb = first(vf[None, :, :] & (comb[None, :, :] >= c_grid[:, None, None]))
+        for t_min, a_min in itertools.product(title_mins, artist_mins):
+            # Accepted, for every combined threshold at once: (len(c_grid), n)
+            accepted = ((bt >= t_min) & (ba >= a_min))[None, :] | (bc[None, :] >= c_grid[:, None])
+            hits = (accepted & picked_right[None, :]).sum(axis=1)
+            n_acc = accepted.sum(axis=1)
+            stop_by_ta = first(early | (vf & (title >= t_min) & (artist >= a_min)))
+            stop = np.minimum(stop_by_comb, stop_by_ta[None, :])
+            stop_calls = np.where(stop < k, calls[rows[None, :], np.minimum(stop, k - 1)], total_calls[None, :])
+            spent = stop_calls.sum(axis=1) + album_calls
+            for i, c_min in enumerate(c_grid):
+                precision = hits[i] / n_acc[i] if n_acc[i] else 0.0
+                recall = hits[i] / has_answer.sum() if has_answer.any() else 0.0
+                f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+                out.append(dict(weight=float(w), title_min=float(t_min), artist_min=float(a_min),
+                                combined_min=float(c_min), precision=float(precision),
+                                recall=float(recall), f1=float(f1), accepted=int(n_acc[i]),
+                                calls=float(spent[i])))
+    return out
+
+def _frange(spec: str) -> List[float]:
+    """"start:stop:step" (inclusive) or a comma-separated list."""
+    if ":" in spec:
+        start, stop, step = (float(x) for x in spec.split(":"))
+        return list(np.round(np.arange(start, stop + step / 2, step), 6))
+    return [float(x) for x in spec.split(",")]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("golden", type=Path, help="labeled report CSV")
+    parser.add_argument("--weights", default="0.5:0.7:0.05", help="title weight (artist gets 1 - w)")
+    parser.add_argument("--title-min", default="80:95:2.5")
+    parser.add_argument("--artist-min", default="65:85:5")
+    parser.add_argument("--combined-min", default="78:92:1")
+    parser.add_argument("--top", type=int, default=20, help="configurations to print, best F1 first")
+    parser.add_argument("--out", type=Path, help="also write every configuration to this CSV")
+    args = parser.parse_args()
+
+    golden = load_golden(args.golden)
+    m = candidate_matrices(golden)
+    n = m[0].shape[0]
+    if not n:
+        raise SystemExit("None of the labeled tracks have stored candidates; run import_music.py on them first.")
+    print(f"{n} labeled tracks with stored candidates ({int(m[8].sum())} with a correct match).")
+    if m[9]:
+        print(f"Album lookups: {m[9]:.0f} calls, the same for every configuration.")
+
+    results = sweep(m, _frange(args.weights), _frange(args.title_min),
+                    _frange(args.artist_min), _frange(args.combined_min))
+    current = sweep(m, [0.6], [im.ACCEPT_TITLE_MIN], [im.ACCEPT_ARTIST_MIN], [im.ACCEPT_COMBINED_MIN])[0]
+    for r in results:
+        r["calls_saved"] = current["calls"] - r["calls"]
+
+    print(f"Current: w=0.6 T>={im.ACCEPT_TITLE_MIN} A>={im.ACCEPT_ARTIST_MIN} C>={im.ACCEPT_COMBINED_MIN} "
+          f"precision {current['precision']:.3f} recall {current['recall']:.3f} calls {current['calls']:.0f}\n")
+    print(f"{'w':>5} {'T':>5} {'A':>5} {'C':>5} {'prec':>6} {'recall':>6} {'F1':>6} {'accepted':>8} {'calls':>8} {'saved':>8}")
+    for r in sorted(results, key=lambda r: (-r["f1"], -r["calls_saved"]))[:args.top]:
+        print(f"{r['weight']:5.2f} {r['title_min']:5.1f} {r['artist_min']:5.1f} {r['combined_min']:5.1f} "
+              f"{r['precision']:6.3f} {r['recall']:6.3f} {r['f1']:6.3f} {r['accepted']:8d} "
+              f"{r['calls']:8.0f} {r['calls_saved']:8.0f}")
+
+    if args.out:
+        with open(args.out, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+        print(f"\nAll {len(results)} configurations: {args.out}")
+
+if __name__ == "__main__":
+    main()